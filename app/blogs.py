@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import hashlib
+import threading
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+BLOG_DIR = Path("app/static/content/blogs")
+BLOG_DATE_FORMAT = "%b %d, %Y"
+# how often request paths are allowed to re-scan the blog dir for changes
+BLOG_INDEX_REFRESH_SECONDS = 5.0
+
+
+@dataclass
+class BlogPost:
+    slug: str
+    title: str
+    date: str
+    published: datetime
+    thumbnail_image: Optional[str]
+    mtime_ns: int
+
+    def to_metadata(self) -> dict:
+        return {"title": self.title, "date": self.date, "thumbnail_image": self.thumbnail_image, "slug": self.slug}
+
+
+def parse_blog_post(blog_file: Path) -> BlogPost:
+    # the title is the first line, the date is the first "Mon DD, YYYY" style line
+    # after it and the thumbnail is the first markdown image in the post
+    mtime_ns = blog_file.stat().st_mtime_ns
+    with open(blog_file, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    title = lines[0].strip()
+    date = None
+    for line in lines[1:]:
+        if "," in line and line[0].isalpha():
+            date = line.strip()
+            break
+    thumbnail = None
+    for line in lines:
+        if line.startswith("![") and "(" in line and ")" in line:
+            thumbnail = line.split("(", 1)[1].rsplit(")", 1)[0].strip()
+            break
+
+    return BlogPost(
+        slug = blog_file.stem,
+        title = title,
+        date = date,
+        published = datetime.strptime(date, BLOG_DATE_FORMAT),
+        thumbnail_image = thumbnail,
+        mtime_ns = mtime_ns,
+    )
+
+
+class BlogIndex:
+    """
+    Parsed blog metadata, kept sorted newest first.
+    Only posts whose file changed since the last scan are re-parsed.
+    """
+
+    def __init__(self, blog_dir: Path = BLOG_DIR, refresh_seconds: float = BLOG_INDEX_REFRESH_SECONDS):
+        self.blog_dir = blog_dir
+        self.refresh_seconds = refresh_seconds
+        # turned off while the content watcher is running, it calls update_post itself
+        self.auto_refresh = True
+        # digest of every post's (slug, mtime), changes whenever any post does
+        self.version = ""
+        self.last_modified_ns = 0
+        self._posts_by_slug: dict[str, BlogPost] = {}
+        self._posts: list[BlogPost] = []
+        self._metadata: list[dict] = []
+        self._last_scan = None
+        self._lock = threading.Lock()
+
+    def _blog_files(self) -> list[Path]:
+        return [f for f in self.blog_dir.glob("*.md") if f.is_file() and f.name != "summary.md"]
+
+    def _rebuild_views(self):
+        posts = sorted(self._posts_by_slug.values(), key=lambda post: post.published, reverse=True)
+        # swap the derived lists in whole so readers never see a partial sort
+        self._posts = posts
+        self._metadata = [post.to_metadata() for post in posts]
+        post_versions = "|".join(f"{post.slug}:{post.mtime_ns}" for post in sorted(posts, key=lambda post: post.slug))
+        self.version = hashlib.sha1(post_versions.encode("utf-8")).hexdigest()
+        self.last_modified_ns = max((post.mtime_ns for post in posts), default=0)
+
+    def scan(self) -> bool:
+        """Re-parse new/changed posts and drop deleted ones. Returns True if anything changed."""
+        with self._lock:
+            self._last_scan = time.monotonic()
+            changed = False
+            seen = set()
+            for blog_file in self._blog_files():
+                slug = blog_file.stem
+                seen.add(slug)
+                post = self._posts_by_slug.get(slug)
+                if post is not None and post.mtime_ns == blog_file.stat().st_mtime_ns:
+                    continue
+                changed = self._parse_into_index(blog_file) or changed
+
+            for slug in list(self._posts_by_slug.keys() - seen):
+                del self._posts_by_slug[slug]
+                changed = True
+
+            if changed:
+                self._rebuild_views()
+            return changed
+
+    def _parse_into_index(self, blog_file: Path) -> bool:
+        try:
+            self._posts_by_slug[blog_file.stem] = parse_blog_post(blog_file)
+            return True
+        except (ValueError, TypeError, IndexError) as e:
+            _logger.warning(f"Skipping blog post with bad header {blog_file}: {e}")
+            return False
+
+    def update_post(self, blog_file: Path):
+        """Re-parse (or drop, if it was deleted) a single post."""
+        if blog_file.name == "summary.md":
+            return
+        with self._lock:
+            if blog_file.is_file():
+                changed = self._parse_into_index(blog_file)
+            else:
+                changed = self._posts_by_slug.pop(blog_file.stem, None) is not None
+            if changed:
+                self._rebuild_views()
+
+    def refresh(self):
+        # cheap enough to call from request paths, only re-scans every refresh_seconds
+        if self._last_scan is None:
+            self.scan()
+        elif self.auto_refresh and time.monotonic() - self._last_scan >= self.refresh_seconds:
+            self.scan()
+
+    def validators(self) -> tuple[str, int]:
+        """(version, last modified ns) of the index, refreshed first so etags follow edited posts."""
+        self.refresh()
+        return self.version, self.last_modified_ns
+
+    @property
+    def posts(self) -> list[BlogPost]:
+        self.refresh()
+        return self._posts
+
+    def metadata(self) -> list[dict]:
+        self.refresh()
+        return self._metadata
+
+    def titles(self) -> list[str]:
+        return [post.title for post in self.posts]
+
+    def get_post(self, slug: str) -> Optional[BlogPost]:
+        self.refresh()
+        return self._posts_by_slug.get(slug)
+
+
+blog_index = BlogIndex()
@@ -0,0 +1,64 @@
+from pathlib import Path
+import os
+import shutil
+
+import numpy as np
+
+from app.blogs import BLOG_DIR
+from app.content_pack import CONTENT_PACK_DIR, ENTRY_DTYPE
+from app.markdown_cache import render_markdown
+from app.wiki import TOPIC_ARTIFACT_DIR
+
+
+def iter_pack_entries():
+    """(key, source path, content) for everything the workers share through the pack."""
+    from app.host import custom_md_pages
+
+    # rendered html for every blog post and custom page, keyed the way markdown_cache looks them up
+    markdown_paths = sorted(BLOG_DIR.glob("*.md")) + list(custom_md_pages.values())
+    for path in markdown_paths:
+        if path.exists():
+            yield f"md/{path.as_posix()}", path, render_markdown(path.read_text(encoding="utf-8")).encode("utf-8")
+
+    # per-topic wiki artifacts from `python -m app.build_wiki`
+    for artifact in sorted(TOPIC_ARTIFACT_DIR.glob("*.json")):
+        yield f"wiki/{artifact.stem}", artifact, artifact.read_bytes()
+
+
+def build_content_pack(pack_dir: Path = CONTENT_PACK_DIR):
+    """
+    Write the read-only content every worker would otherwise render/parse into
+    its own memory into one memory-mappable pack (see content_pack.py).
+    """
+    packed = {}
+    for key, path, content in iter_pack_entries():
+        stat = path.stat()
+        packed[key] = (content, stat.st_mtime_ns, stat.st_size)
+
+    keys = sorted(packed.keys())
+    entries = np.zeros(len(keys), dtype=ENTRY_DTYPE)
+
+    build_dir = pack_dir.with_name(f"{pack_dir.name}.tmp")
+    if build_dir.exists():
+        shutil.rmtree(build_dir)
+    build_dir.mkdir(parents=True)
+    offset = 0
+    with open(build_dir / "content.bin", "wb") as f:
+        for idx, key in enumerate(keys):
+            content, mtime_ns, size = packed[key]
+            f.write(content)
+            entries[idx] = (offset, len(content), mtime_ns, size)
+            offset += len(content)
+    # fixed width bytes so the keys can be binary searched straight off the mapping
+    np.save(build_dir / "keys.npy", np.array([key.encode("utf-8") for key in keys], dtype=bytes))
+    np.save(build_dir / "entries.npy", entries)
+
+    # swap the finished pack in, workers still mapping the old files keep a consistent view
+    if pack_dir.exists():
+        shutil.rmtree(pack_dir)
+    os.replace(build_dir, pack_dir)
+    print(f"Packed {len(keys)} entries ({offset / 1e6:.1f} MB) into {pack_dir}")
+
+
+if __name__ == "__main__":
+    build_content_pack()
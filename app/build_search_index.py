@@ -0,0 +1,80 @@
+from pathlib import Path
+import json
+import os
+import shutil
+
+import numpy as np
+
+from app.blogs import blog_index
+from app.full_text_search import tokenize, SEARCH_INDEX_DIR
+from app.wiki import clean_topic_name, wiki_store
+
+
+def iter_documents():
+    """(kind, title, url, text) for every wiki topic and blog post."""
+    # always index the monolithic source files, never the rendered artifacts
+    store = wiki_store.load(use_artifacts=False)
+    titles = {clean_topic_name(topic): topic for topic in store.get_topics()}
+    for topic, sections in store.content.sections.items():
+        title = titles.get(topic, topic.replace("_", " "))
+        text_parts = [title]
+        for section_title, section_content in sections.items():
+            text_parts += [section_title, section_content]
+        text_parts.append(store.get_related_to_me(topic))
+        yield "wiki", title, f"/wiki/{topic}", "\n".join(text_parts)
+
+    for post in blog_index.posts:
+        md_text = (blog_index.blog_dir / f"{post.slug}.md").read_text(encoding="utf-8")
+        yield "blog", post.title, f"/blog/{post.slug}", md_text
+
+
+def build_search_index(index_dir: Path = SEARCH_INDEX_DIR):
+    """
+    Build the BM25 inverted index with positional postings over wiki section
+    bodies, the related-to-me content and blog posts.
+    """
+    docs = []
+    doc_lengths = []
+    # term -> [(doc id, positions)], doc ids are appended in increasing order
+    postings: dict[str, list] = {}
+    for kind, title, url, text in iter_documents():
+        doc_id = len(docs)
+        docs.append({"kind": kind, "title": title, "url": url})
+        tokens = tokenize(text)
+        doc_lengths.append(len(tokens))
+        term_positions: dict[str, list[int]] = {}
+        for position, token in enumerate(tokens):
+            term_positions.setdefault(token, []).append(position)
+        for term, positions in term_positions.items():
+            postings.setdefault(term, []).append((doc_id, positions))
+
+    lexicon = {}
+    doc_ids, freqs, positions = [], [], []
+    for term in sorted(postings.keys()):
+        lexicon[term] = [len(postings[term]), len(doc_ids), len(positions)]
+        for doc_id, term_positions in postings[term]:
+            doc_ids.append(doc_id)
+            freqs.append(len(term_positions))
+            positions.extend(term_positions)
+
+    build_dir = index_dir.with_name(f"{index_dir.name}.tmp")
+    if build_dir.exists():
+        shutil.rmtree(build_dir)
+    build_dir.mkdir(parents=True)
+    np.save(build_dir / "doc_ids.npy", np.array(doc_ids, dtype=np.uint32))
+    np.save(build_dir / "freqs.npy", np.array(freqs, dtype=np.uint32))
+    np.save(build_dir / "positions.npy", np.array(positions, dtype=np.uint32))
+    np.save(build_dir / "doc_lengths.npy", np.array(doc_lengths, dtype=np.float32))
+    with open(build_dir / "lexicon.json", "w") as f:
+        f.write(json.dumps(lexicon, separators=(",", ":")))
+    with open(build_dir / "docs.json", "w") as f:
+        f.write(json.dumps(docs, separators=(",", ":")))
+
+    if index_dir.exists():
+        shutil.rmtree(index_dir)
+    os.replace(build_dir, index_dir)
+    print(f"Indexed {len(docs)} documents, {len(positions)} tokens, {len(lexicon)} terms into {index_dir}")
+
+
+if __name__ == "__main__":
+    build_search_index()
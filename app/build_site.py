@@ -0,0 +1,205 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import json
+import os
+import shutil
+
+from starlette.requests import Request
+from starlette.responses import FileResponse
+
+from app.http_cache import conditional_response, encoded_etag, file_response_version, make_etag, PAGE_CACHE_CONTROL
+from app.compression import PRECOMPRESSED_SUFFIXES, get_accepted_encodings
+
+PRERENDERED_DIR = Path(os.environ.get("PRERENDERED_SITE_DIR", "app/prerendered"))
+HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+RSS_MEDIA_TYPE = "application/rss+xml"
+
+
+def get_site_routes() -> list[str]:
+    """Every page on the site that only depends on static content."""
+    from app.host import custom_md_pages, get_blog_metadata
+    from app.wiki import get_wiki_store, clean_topic_name
+
+    routes = ["/", "/blogs", "/rss"]
+    routes += [f"/{page_route}" for page_route in custom_md_pages.keys()]
+    routes += [f"/blog/{blog['slug']}" for blog in get_blog_metadata()]
+
+    store = get_wiki_store()
+    for topic in store.get_topics():
+        topic_path = clean_topic_name(topic)
+        if store.has_topic(topic_path):
+            routes.append(f"/wiki/{topic_path}")
+    return routes
+
+
+def get_route_file(route: str) -> str:
+    # file layout works with a plain static server, e.g. nginx `try_files $uri.html $uri.xml`
+    if route == "/":
+        return "index.html"
+    if route == "/rss":
+        return "rss.xml"
+    return f"{route.lstrip('/')}.html"
+
+
+def render_route(route: str) -> tuple[str, str, str]:
+    """Render one route with the site templates. Returns (route, media_type, content)."""
+    from app import host, wiki
+
+    templates = host.templates
+    if route == "/":
+        content = templates.get_template("pages/landing.html").render({"landing_page": True})
+    elif route == "/blogs":
+        content = templates.get_template("pages/blogs.html").render(host.get_blogs_landing_context())
+    elif route == "/rss":
+        content = templates.get_template("rss.xml").render(host.get_rss_context())
+        return route, RSS_MEDIA_TYPE, content
+    elif route.startswith("/blog/"):
+        page_name = route.removeprefix("/blog/")
+        content = templates.get_template("pages/blog.html").render(host.get_blog_page_context(page_name))
+    elif route.startswith("/wiki/"):
+        topic = route.removeprefix("/wiki/")
+        content = templates.get_template("pages/wiki.html").render(wiki.get_wiki_page_context(topic))
+    else:
+        content_path = host.custom_md_pages[route.lstrip("/")]
+        content = templates.get_template("pages/generic_md_page.html").render(host.get_generic_page_context(content_path))
+    return route, HTML_MEDIA_TYPE, content
+
+
+def get_route_version(route: str) -> str:
+    """
+    Version of what a route is rendered from, made of the same parts as the live
+    route's etag. Raises FileNotFoundError if a page's markdown is gone.
+    """
+    from app import host, http_cache, wiki
+    from app.markdown_cache import markdown_cache
+
+    if route == "/":
+        parts = ("home",)
+    elif route in ("/blogs", "/rss"):
+        parts = (route, host.get_blog_index_validators()[0])
+    elif route.startswith("/blog/"):
+        parts = ("blog", markdown_cache.version(host.get_blog_path(route.removeprefix("/blog/"))))
+    elif route.startswith("/wiki/"):
+        topic = route.removeprefix("/wiki/")
+        parts = ("wiki", topic, wiki.get_wiki_store().get_topic_version(topic))
+    else:
+        parts = ("page", markdown_cache.version(host.custom_md_pages[route.lstrip("/")]))
+    return make_etag(*parts, http_cache.TEMPLATES_VERSION)
+
+
+def build_site(output_dir: Path = PRERENDERED_DIR, max_workers: int = None):
+    """
+    Pre-render every static page (blogs, custom pages, rss and wiki topics) to
+    html files plus a manifest.json mapping each route to its file.
+    """
+    routes = get_site_routes()
+    # taken before rendering, so a source edited mid build leaves its page stale (and skipped) rather than wrongly fresh
+    versions = {route: get_route_version(route) for route in routes}
+
+    build_dir = output_dir.with_name(f"{output_dir.name}.tmp")
+    if build_dir.exists():
+        shutil.rmtree(build_dir)
+    build_dir.mkdir(parents=True)
+
+    manifest = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for route, media_type, content in executor.map(render_route, routes, chunksize=16):
+            route_file = get_route_file(route)
+            page_path = build_dir / route_file
+            page_path.parent.mkdir(parents=True, exist_ok=True)
+            page_path.write_text(content, encoding="utf-8")
+            manifest[route] = {"file": route_file, "media_type": media_type, "version": versions[route]}
+
+    with open(build_dir / "manifest.json", "w") as f:
+        f.write(json.dumps(manifest, indent=2))
+
+    # swap the finished build in so a server never sees a partial site
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    os.replace(build_dir, output_dir)
+    print(f"Pre-rendered {len(manifest)} pages to {output_dir}")
+
+
+def load_prerendered_site(output_dir: Path = PRERENDERED_DIR) -> dict:
+    """
+    Map of route -> {"path", "media_type", "etag", "last_modified", "encodings", "version"}
+    for a previous build_site run (empty if there isn't one). "encodings" maps
+    content-encoding -> path for any precompressed siblings, "version" is the
+    get_route_version() the page was rendered at (None for older builds).
+    """
+    manifest_path = output_dir / "manifest.json"
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, "r") as f:
+        manifest = json.loads(f.read())
+    pages = {}
+    for route, page in manifest.items():
+        page_path = output_dir / page["file"]
+        etag, last_modified = file_response_version(page_path)
+        encodings = {}
+        for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+            compressed_path = page_path.with_name(page_path.name + suffix)
+            if compressed_path.exists():
+                encodings[encoding] = compressed_path
+        pages[route] = {
+            "path": page_path,
+            "media_type": page["media_type"],
+            "etag": etag,
+            "last_modified": last_modified,
+            "encodings": encodings,
+            "version": page.get("version"),
+        }
+    return pages
+
+
+class PrerenderedPagesMiddleware:
+    """
+    Plain ASGI middleware answering GETs (and HEADs) for routes in a load_prerendered_site()
+    map straight from disk, anything else is passed on to the app untouched. So is a
+    page whose sources changed since the build (e.g. markdown the content watcher
+    reloaded), the app renders it fresh until the site is rebuilt.
+    """
+
+    def __init__(self, app, pages: dict):
+        self.app = app
+        self.pages = pages
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            page = self.pages.get(scope["path"])
+            if page is not None and self.is_current(scope["path"], page):
+                response = self.page_response(Request(scope, receive), page)
+                return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def is_current(route: str, page: dict) -> bool:
+        if page["version"] is None:
+            # built before versions were recorded, nothing to compare against
+            return True
+        try:
+            return get_route_version(route) == page["version"]
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def page_response(request: Request, page: dict):
+        accepted = get_accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((encoding for encoding in accepted if encoding in page["encodings"]), None)
+        if encoding is not None:
+            etag = encoded_etag(page["etag"], encoding)
+            render_page = lambda: FileResponse(page["encodings"][encoding], media_type=page["media_type"], headers={"Content-Encoding": encoding})
+        else:
+            etag = page["etag"]
+            render_page = lambda: FileResponse(page["path"], media_type=page["media_type"])
+        return conditional_response(
+            request,
+            etag,
+            render_page,
+            cache_control=PAGE_CACHE_CONTROL,
+            last_modified=page["last_modified"],
+        )
+
+
+if __name__ == "__main__":
+    build_site()
@@ -0,0 +1,53 @@
+from pathlib import Path
+import json
+import os
+from app.wiki import (
+    TopicPage,
+    build_topic_page,
+    get_topic_thumbnail,
+    wiki_store,
+    TOPIC_ARTIFACT_DIR,
+    TOPIC_THUMBNAILS_FILE,
+)
+
+
+def write_topic_artifact(topic_page: TopicPage, artifact_dir: Path):
+    artifact_path = artifact_dir / f"{topic_page.topic}.json"
+    tmp_path = artifact_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(topic_page.to_dict(), separators=(",", ":")))
+    os.replace(tmp_path, artifact_path)
+
+
+def build_wiki_artifacts(artifact_dir: Path = TOPIC_ARTIFACT_DIR):
+    """
+    Split the monolithic generated wiki json into one compact, pre-rendered
+    artifact per topic so the site only ever loads the topic being viewed.
+    """
+    # always build from the monolithic source files, never from old artifacts
+    store = wiki_store.load(use_artifacts=False)
+
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    built_topics = set()
+    thumbnails = {}
+    for topic in store.content.sections.keys():
+        topic_page = build_topic_page(topic)
+        write_topic_artifact(topic_page, artifact_dir)
+        thumbnails[topic] = get_topic_thumbnail(topic_page.sections[0])
+        built_topics.add(topic)
+
+    tmp_path = TOPIC_THUMBNAILS_FILE.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(thumbnails, separators=(",", ":")))
+    os.replace(tmp_path, TOPIC_THUMBNAILS_FILE)
+
+    # drop artifacts for topics that no longer exist
+    for artifact in artifact_dir.glob("*.json"):
+        if artifact.stem not in built_topics:
+            artifact.unlink()
+
+    print(f"Built {len(built_topics)} wiki topic artifacts in {artifact_dir}")
+
+
+if __name__ == "__main__":
+    build_wiki_artifacts()
@@ -0,0 +1,132 @@
+from pathlib import Path
+from typing import List, Optional
+import gzip
+import mimetypes
+import os
+import stat
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = Path("app/static")
+# images/fonts are already compressed, only text assets get .gz/.br siblings
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".map", ".svg", ".html", ".xml", ".json", ".txt"}
+COMPRESSIBLE_MEDIA_TYPES = ("text/", "application/json", "application/xml", "application/rss+xml", "application/javascript", "image/svg+xml")
+# encoding -> file suffix, in order of preference
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"} if brotli is not None else {"gzip": ".gz"}
+
+
+def get_accepted_encodings(accept_encoding: str) -> List[str]:
+    """Encodings we can produce that an Accept-Encoding header allows, most preferred first."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                accepted[coding] = float(quality[2:]) > 0
+            except ValueError:
+                continue
+        else:
+            accepted[coding] = True
+    # "*" only covers codings the header doesn't name, an explicit br;q=0 still refuses br
+    return [encoding for encoding in PRECOMPRESSED_SUFFIXES.keys() if accepted.get(encoding, accepted.get("*", False))]
+
+
+def get_accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """Best encoding we can produce for an Accept-Encoding header (None for identity)."""
+    encodings = get_accepted_encodings(accept_encoding)
+    return encodings[0] if encodings else None
+
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    return media_type is not None and media_type.startswith(COMPRESSIBLE_MEDIA_TYPES)
+
+
+def compress_body(body: bytes, encoding: str, static: bool = False) -> bytes:
+    # build time assets get max compression, dynamic pages a cheaper level
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else 6)
+    return gzip.compress(body, compresslevel=9 if static else 6, mtime=0)
+
+
+def precompress_file(path: Path) -> int:
+    """Write .gz/.br siblings for one file if they're missing or stale. Returns how many were written."""
+    written = 0
+    source_mtime = path.stat().st_mtime_ns
+    body = None
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+        compressed_path = path.with_name(path.name + suffix)
+        if compressed_path.exists() and compressed_path.stat().st_mtime_ns >= source_mtime:
+            continue
+        if body is None:
+            body = path.read_bytes()
+        compressed = compress_body(body, encoding, static=True)
+        # not worth serving a variant that isn't smaller
+        if len(compressed) >= len(body):
+            compressed_path.unlink(missing_ok=True)
+            continue
+        tmp_path = compressed_path.with_name(compressed_path.name + ".tmp")
+        tmp_path.write_bytes(compressed)
+        os.replace(tmp_path, compressed_path)
+        written += 1
+    return written
+
+
+def precompress_static(directories: list[Path] = None):
+    """Build step: write .gz (and .br when brotli is installed) siblings for text assets."""
+    directories = directories or [STATIC_DIR]
+    written = 0
+    for directory in directories:
+        if not directory.exists():
+            continue
+        for path in directory.rglob("*"):
+            if path.is_file() and path.suffix in COMPRESSIBLE_SUFFIXES:
+                written += precompress_file(path)
+    print(f"Wrote {written} precompressed files ({', '.join(PRECOMPRESSED_SUFFIXES.keys())})")
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves a .br/.gz sibling when the client accepts it."""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        request_headers = Headers(scope=scope)
+        suffix = os.path.splitext(path)[1]
+
+        if suffix in COMPRESSIBLE_SUFFIXES and scope["method"] in ("GET", "HEAD"):
+            # not every file has every sibling (e.g. no .br when it wasn't smaller), fall back to the next accepted one
+            for encoding in get_accepted_encodings(request_headers.get("accept-encoding", "")):
+                try:
+                    full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + PRECOMPRESSED_SUFFIXES[encoding])
+                except OSError:
+                    stat_result = None
+                if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                    continue
+                response = FileResponse(
+                    full_path,
+                    stat_result=stat_result,
+                    media_type=mimetypes.guess_type(path)[0] or "text/plain",
+                    headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+                )
+                if self.is_not_modified(response.headers, request_headers):
+                    return NotModifiedResponse(response.headers)
+                return response
+
+        response = await super().get_response(path, scope)
+        if suffix in COMPRESSIBLE_SUFFIXES:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+if __name__ == "__main__":
+    precompress_static([STATIC_DIR, Path("app/prerendered")])
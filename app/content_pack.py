@@ -0,0 +1,91 @@
+from pathlib import Path
+from typing import Optional
+import logging
+import mmap
+import os
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+CONTENT_PACK_DIR = Path(os.environ.get("CONTENT_PACK_DIR", "app/content_pack"))
+# set to false to ignore a built pack (every worker then renders/parses its own copy)
+CONTENT_PACK = os.environ.get("CONTENT_PACK", "true").lower() in ("1", "true")
+
+# one row per key, in the same (sorted) order as keys.npy. mtime_ns + size are
+# the version of the source file the content was built from
+ENTRY_DTYPE = np.dtype([
+    ("offset", "u8"),
+    ("length", "u8"),
+    ("mtime_ns", "i8"),
+    ("size", "i8"),
+])
+
+
+class ContentPack:
+    """
+    Read side of the pack written by build_content_pack.py: pre-rendered
+    content (rendered markdown, wiki topic artifacts) concatenated into one
+    content.bin plus a sorted key array and an entry table.
+
+    All three files are memory-mapped read only, so every worker on the host
+    shares the same page cache pages instead of holding its own parsed or
+    rendered copy, and a lookup is a binary search over the mapped keys.
+    """
+
+    def __init__(self, pack_dir: Path = CONTENT_PACK_DIR):
+        self.pack_dir = pack_dir
+        self.keys = np.load(pack_dir / "keys.npy", mmap_mode="r")
+        self.entries = np.load(pack_dir / "entries.npy", mmap_mode="r")
+        with open(pack_dir / "content.bin", "rb") as f:
+            # mmap can't map an empty file
+            self._content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(key) is not None
+
+    def _find(self, key: str) -> Optional[int]:
+        key_bytes = key.encode("utf-8")
+        idx = int(np.searchsorted(self.keys, key_bytes))
+        if idx < len(self.keys) and self.keys[idx] == key_bytes:
+            return idx
+        return None
+
+    def get(self, key: str, source_version: Optional[tuple] = None) -> Optional[bytes]:
+        """
+        Content for key, or None if it isn't packed. With source_version
+        ((mtime_ns, size) of the source file) a pack built from an older
+        version of the file also returns None, so callers fall back to the file.
+        """
+        idx = self._find(key)
+        if idx is None:
+            return None
+        entry = self.entries[idx]
+        if source_version is not None and (int(entry["mtime_ns"]), int(entry["size"])) != tuple(source_version):
+            return None
+        offset = int(entry["offset"])
+        return self._content[offset:offset + int(entry["length"])]
+
+    def get_text(self, key: str, source_version: Optional[tuple] = None) -> Optional[str]:
+        content = self.get(key, source_version)
+        return content.decode("utf-8") if content is not None else None
+
+
+_content_pack: Optional[ContentPack] = None
+
+def load_content_pack(pack_dir: Path = CONTENT_PACK_DIR) -> Optional[ContentPack]:
+    """(Re)map the pack, content is read from the source files as before if it hasn't been built."""
+    global _content_pack
+    if not CONTENT_PACK or not (pack_dir / "keys.npy").exists():
+        _logger.info(f"No content pack in {pack_dir}, run `python -m app.build_content_pack` to share content between workers")
+        _content_pack = None
+        return None
+    _content_pack = ContentPack(pack_dir)
+    _logger.info(f"Mapped content pack with {len(_content_pack)} entries")
+    return _content_pack
+
+def get_content_pack() -> Optional[ContentPack]:
+    return _content_pack
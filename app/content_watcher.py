@@ -0,0 +1,118 @@
+from pathlib import Path
+from typing import Sequence
+import asyncio
+import logging
+import os
+
+from app.blogs import blog_index, BLOG_DIR
+from app.http_cache import refresh_templates_version, TEMPLATE_DIR
+from app.markdown_cache import markdown_cache
+from app.wiki import (
+    wiki_store,
+    invalidate_topic_search_index,
+    GENERATED_CONTENT_DIR,
+    TOPIC_ARTIFACT_DIR,
+    TOPIC_THUMBNAILS_FILE,
+    HITCHCOCK_FACTS_FILE,
+)
+
+_logger = logging.getLogger(__name__)
+
+CONTENT_DIR = Path("app/static/content")
+CONTENT_WATCH = os.environ.get("CONTENT_WATCH", "true").lower() in ("1", "true")
+CONTENT_WATCH_INTERVAL = float(os.environ.get("CONTENT_WATCH_INTERVAL", "2"))
+
+
+def handle_content_change(path: Path):
+    """Refresh only the cached entry that depends on the changed file."""
+    if path.suffix == ".md":
+        if path.parent == BLOG_DIR:
+            blog_index.update_post(path)
+        markdown_cache.refresh(path)
+    elif path.parent == TOPIC_ARTIFACT_DIR and path.suffix == ".json":
+        wiki_store.reload_topic(path.stem)
+    elif path == HITCHCOCK_FACTS_FILE:
+        wiki_store.reload_facts()
+    elif path == TOPIC_THUMBNAILS_FILE:
+        invalidate_topic_search_index()
+    elif path.parent == GENERATED_CONTENT_DIR:
+        wiki_store.reload_file(path.name)
+    elif path.suffix == ".html" and path.is_relative_to(TEMPLATE_DIR):
+        # every page etag mixes in the templates version
+        refresh_templates_version()
+    else:
+        return
+    _logger.info(f"Refreshed cached content for {path}")
+
+
+class ContentWatcher:
+    """
+    Background task that keeps the in-memory content caches fresh.
+    Uses inotify (through watchfiles) when it's installed and falls back to
+    polling mtimes every `interval` seconds.
+    """
+
+    def __init__(self, roots: Sequence[Path] = (CONTENT_DIR, TEMPLATE_DIR), interval: float = CONTENT_WATCH_INTERVAL):
+        self.roots = list(roots)
+        self.interval = interval
+
+    def _snapshot(self) -> dict:
+        mtimes = {}
+        for root in self.roots:
+            for dir_path, _, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(dir_path, filename)
+                    try:
+                        mtimes[path] = os.stat(path).st_mtime_ns
+                    except FileNotFoundError:
+                        continue
+        return mtimes
+
+    def _dispatch(self, changed_paths: set):
+        for path in sorted(changed_paths):
+            # the temp files written by the build scripts are swapped in with os.replace
+            if path.endswith(".tmp"):
+                continue
+            try:
+                handle_content_change(Path(path))
+            except Exception as e:
+                _logger.warning(f"Failed to refresh cached content for {path}: {e}")
+
+    async def _poll(self):
+        snapshot = await asyncio.to_thread(self._snapshot)
+        while True:
+            await asyncio.sleep(self.interval)
+            new_snapshot = await asyncio.to_thread(self._snapshot)
+            changed = {
+                path for path in snapshot.keys() | new_snapshot.keys()
+                if snapshot.get(path) != new_snapshot.get(path)
+            }
+            snapshot = new_snapshot
+            if changed:
+                await asyncio.to_thread(self._dispatch, changed)
+
+    async def _watch(self, awatch):
+        async for changes in awatch(*self.roots):
+            # watchfiles reports absolute paths, the caches are keyed on paths relative to the repo root
+            changed = {os.path.relpath(path) for _, path in changes}
+            await asyncio.to_thread(self._dispatch, changed)
+
+    async def run(self):
+        # the watcher owns freshness now, requests can skip their own stat checks
+        markdown_cache.validate_mtime = False
+        blog_index.auto_refresh = False
+        try:
+            try:
+                from watchfiles import awatch
+            except ImportError:
+                _logger.info(f"watchfiles not installed, polling {', '.join(map(str, self.roots))} every {self.interval}s")
+                await self._poll()
+            else:
+                _logger.info(f"Watching {', '.join(map(str, self.roots))} for content changes")
+                await self._watch(awatch)
+        finally:
+            markdown_cache.validate_mtime = True
+            blog_index.auto_refresh = True
+
+    def start(self) -> asyncio.Task:
+        return asyncio.create_task(self.run())
@@ -0,0 +1,223 @@
+from pathlib import Path
+from typing import List, Optional, Tuple
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from app.face_tracking import Box, Eyes, get_box, get_eyes
+
+_logger = logging.getLogger(__name__)
+
+# "disabled" - no /face routes at all (blog/wiki only workers)
+# "lazy"     - deepface/tensorflow are imported on the first /face request (or at startup with FACE_WARMUP)
+# "worker"   - the model lives in a separate `python -m app.face_worker` process reached over FACE_WORKER_SOCKET
+FACE_MODE = os.environ.get("FACE_MODE", "lazy").lower()
+FACE_WARMUP = os.environ.get("FACE_WARMUP", "false").lower() in ("1", "true")
+FACE_WORKER_SOCKET = os.environ.get("FACE_WORKER_SOCKET", "/tmp/face_worker.sock")
+FACE_WORKER_TIMEOUT_SECONDS = float(os.environ.get("FACE_WORKER_TIMEOUT_SECONDS", "60"))
+
+MODEL_NAME = "Facenet512"
+DETECTOR_BACKEND = "mtcnn"
+
+
+class FaceWorkerError(RuntimeError):
+    pass
+
+
+class InProcessFaceBackend:
+    """Runs the models in this process, deepface (and tensorflow) are only imported on first use."""
+
+    def __init__(self):
+        self._deepface = None
+        self._lock = threading.Lock()
+
+    def _model(self):
+        if self._deepface is None:
+            with self._lock:
+                if self._deepface is None:
+                    _logger.info("Importing deepface")
+                    from deepface import DeepFace
+                    self._deepface = DeepFace
+        return self._deepface
+
+    def warmup(self) -> None:
+        # a throwaway forward pass builds + caches the model weights
+        self.represent_face(np.zeros((160, 160, 3), dtype=np.uint8), (0, 0, 160, 160))
+
+    def embed_image_file(self, path: Path) -> Optional[np.ndarray]:
+        """Embedding of the first face in an image file, None if no face was found. Errors are raised."""
+        embedding = self._model().represent(
+            img_path=str(path),
+            model_name=MODEL_NAME,
+            detector_backend=DETECTOR_BACKEND,
+            align=True,
+            enforce_detection=False
+        )
+        return np.array(embedding[0]["embedding"]) if embedding else None
+
+    def represent_images(self, images: List[np.ndarray]) -> List[list]:
+        """Detection + embedding for a batch of decoded (bgr) images."""
+        if len(images) == 1:
+            return [self._model().represent(
+                img_path=images[0],
+                model_name=MODEL_NAME,
+                detector_backend=DETECTOR_BACKEND,
+                align=True,
+                enforce_detection=False
+            )]
+        # a list of images runs as one batched forward pass, with one list of faces per image
+        return self._model().represent(
+            img_path=images,
+            model_name=MODEL_NAME,
+            detector_backend=DETECTOR_BACKEND,
+            align=True,
+            enforce_detection=False
+        )
+
+    def detect_faces(self, image: np.ndarray) -> List[Tuple[Box, Optional[Eyes]]]:
+        """Face detection only (no embedding), (box, eyes) per face."""
+        faces = self._model().extract_faces(
+            img_path=image,
+            detector_backend=DETECTOR_BACKEND,
+            align=False,
+            enforce_detection=False
+        )
+        # with enforce_detection off deepface returns the whole frame with confidence 0 when there's no face
+        return [(get_box(face["facial_area"]), get_eyes(face["facial_area"])) for face in faces if face.get("confidence", 0) > 0]
+
+    def represent_face(self, image: np.ndarray, box: Box, eyes: Optional[Eyes] = None) -> np.ndarray:
+        """Embedding of an already detected face, skipping a second detection pass.
+
+        The crop is aligned on the eyes exactly like represent(align=True) does for the gallery
+        images, so stream embeddings land in the same space and the same match threshold applies.
+        """
+        x, y, w, h = box
+        face = image[y:y + h, x:x + w]
+        if eyes is not None:
+            self._model()
+            from deepface.models.Detector import FacialAreaRegion
+            from deepface.modules.detection import extract_face
+            face = extract_face(
+                facial_area=FacialAreaRegion(x=x, y=y, w=w, h=h, left_eye=eyes[0], right_eye=eyes[1]),
+                img=image,
+                align=True,
+                expand_percentage=0,
+                width_border=0,
+                height_border=0,
+                detector_backend=DETECTOR_BACKEND
+            ).img
+        embedding = self._model().represent(
+            img_path=face,
+            model_name=MODEL_NAME,
+            detector_backend="skip",
+            enforce_detection=False
+        )
+        return np.array(embedding[0]["embedding"])
+
+
+# wire format (both ways): 4 byte big endian header length, json header, then the raw bytes of
+# every array listed in header["arrays"] back to back. plain json + bytes rather than pickle so
+# anything able to reach the socket can't get code executed in the other process
+def send_message(sock: socket.socket, header: dict, arrays: List[np.ndarray] = ()) -> None:
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    header = {**header, "arrays": [{"shape": array.shape, "dtype": array.dtype.str} for array in arrays]}
+    header_bytes = json.dumps(header).encode()
+    sock.sendall(struct.pack(">I", len(header_bytes)) + header_bytes)
+    for array in arrays:
+        sock.sendall(memoryview(array).cast("B"))
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Face worker socket closed")
+        received += count
+    return bytes(buffer)
+
+
+def receive_message(sock: socket.socket) -> Tuple[dict, List[np.ndarray]]:
+    (header_size,) = struct.unpack(">I", _receive_exactly(sock, 4))
+    header = json.loads(_receive_exactly(sock, header_size))
+    arrays = []
+    for spec in header.pop("arrays"):
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        data = _receive_exactly(sock, int(np.prod(shape)) * dtype.itemsize)
+        arrays.append(np.frombuffer(data, dtype=dtype).reshape(shape))
+    return header, arrays
+
+
+class SocketFaceBackend:
+    """Same interface as InProcessFaceBackend, forwarded to the face worker process over a unix socket.
+
+    Calls come from the inference pool threads, each thread keeps its own connection.
+    """
+
+    def __init__(self, path: str = FACE_WORKER_SOCKET, timeout: float = FACE_WORKER_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError as e:
+                sock.close()
+                raise FaceWorkerError(f"Face worker is not reachable at {self.path}: {e}")
+            self._local.sock = sock
+        return sock
+
+    def _call(self, op: str, arrays: List[np.ndarray] = (), **args) -> Tuple[dict, List[np.ndarray]]:
+        sock = self._connection()
+        try:
+            send_message(sock, {"op": op, "args": args}, arrays)
+            header, result_arrays = receive_message(sock)
+        except (OSError, ValueError) as e:
+            # drop the connection, the next call reconnects (e.g. after a worker restart)
+            sock.close()
+            self._local.sock = None
+            raise FaceWorkerError(f"Face worker call {op} failed: {e}")
+        if not header.get("ok"):
+            raise FaceWorkerError(header.get("error", f"Face worker call {op} failed"))
+        return header, result_arrays
+
+    def warmup(self) -> None:
+        self._call("warmup")
+
+    def embed_image_file(self, path: Path) -> Optional[np.ndarray]:
+        _, arrays = self._call("embed_image_file", path=str(Path(path).resolve()))
+        return arrays[0] if arrays else None
+
+    def represent_images(self, images: List[np.ndarray]) -> List[list]:
+        header, _ = self._call("represent_images", images)
+        return header["result"]
+
+    def detect_faces(self, image: np.ndarray) -> List[Tuple[Box, Optional[Eyes]]]:
+        header, _ = self._call("detect_faces", [image])
+        return [(tuple(box), tuple(map(tuple, eyes)) if eyes else None) for box, eyes in header["result"]]
+
+    def represent_face(self, image: np.ndarray, box: Box, eyes: Optional[Eyes] = None) -> np.ndarray:
+        _, arrays = self._call("represent_face", [image], box=list(box), eyes=eyes)
+        return arrays[0]
+
+
+def create_face_backend(mode: str = FACE_MODE):
+    if mode == "worker":
+        return SocketFaceBackend()
+    return InProcessFaceBackend()
+
+
+face_backend = create_face_backend()
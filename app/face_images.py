@@ -0,0 +1,70 @@
+from io import BytesIO
+import os
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# uploads are shrunk so the longest side is at most this many pixels before detection,
+# mtcnn cost grows with pixel count and faces from a shop camera are plenty big (0 = no limit)
+FACE_MAX_IMAGE_SIDE = int(os.environ.get("FACE_MAX_IMAGE_SIDE", "640"))
+RAW_FRAME_CHANNELS = {"rgb": 3, "gray": 1}
+# raw frames bigger than this (a 4k rgb frame is ~25MB) are rejected before their body is read
+FACE_MAX_RAW_FRAME_BYTES = int(os.environ.get("FACE_MAX_RAW_FRAME_BYTES", str(32 * 1024 * 1024)))
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def _resize_to_max_side(image: Image.Image, max_side: int) -> Image.Image:
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    return image
+
+
+def rgb_to_bgr(pixels: np.ndarray) -> np.ndarray:
+    # deepface treats numpy inputs like cv2.imread output (bgr)
+    return np.ascontiguousarray(pixels[:, :, ::-1])
+
+
+def decode_image(data: bytes, max_side: int = FACE_MAX_IMAGE_SIDE) -> np.ndarray:
+    """Decode an uploaded jpeg/png straight from memory to a bgr uint8 array."""
+    try:
+        image = Image.open(BytesIO(data))
+        if max_side and image.format == "JPEG" and max(image.size) > max_side:
+            # let libjpeg decode at a reduced scale (1/2, 1/4, 1/8) instead of decoding full size then shrinking
+            scale = max_side / max(image.size)
+            image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    except (UnidentifiedImageError, OSError) as e:
+        raise InvalidImage(f"Could not decode image: {e}")
+    return rgb_to_bgr(np.asarray(_resize_to_max_side(image, max_side)))
+
+
+def raw_frame_size(width: int, height: int, pixel_format: str = "rgb") -> int:
+    """Byte size of a raw frame, so a request body can be bounded before it is read."""
+    channels = RAW_FRAME_CHANNELS.get(pixel_format)
+    if channels is None:
+        raise InvalidImage(f"Unsupported pixel format {pixel_format}, expected one of {list(RAW_FRAME_CHANNELS)}")
+    if width <= 0 or height <= 0:
+        raise InvalidImage(f"Invalid frame size {width}x{height}")
+    size = width * height * channels
+    if size > FACE_MAX_RAW_FRAME_BYTES:
+        raise InvalidImage(f"A {width}x{height}x{channels} frame is over the {FACE_MAX_RAW_FRAME_BYTES} byte limit")
+    return size
+
+
+def decode_raw_frame(data: bytes, width: int, height: int, pixel_format: str = "rgb", max_side: int = FACE_MAX_IMAGE_SIDE) -> np.ndarray:
+    """Wrap a raw row major uint8 rgb/gray frame (no encode/decode) as a bgr array."""
+    size = raw_frame_size(width, height, pixel_format)
+    channels = RAW_FRAME_CHANNELS[pixel_format]
+    if len(data) != size:
+        raise InvalidImage(f"Expected {width}x{height}x{channels} = {size} bytes, got {len(data)}")
+
+    pixels = np.frombuffer(data, dtype=np.uint8).reshape(height, width, channels)
+    if max_side and max(width, height) > max_side:
+        image = _resize_to_max_side(Image.fromarray(pixels.squeeze(axis=2) if channels == 1 else pixels), max_side)
+        pixels = np.asarray(image).reshape(image.height, image.width, channels)
+    if channels == 1:
+        return np.ascontiguousarray(np.repeat(pixels, 3, axis=2))
+    return rgb_to_bgr(pixels)
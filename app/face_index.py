@@ -0,0 +1,256 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
+import copy
+import os
+
+# "exact" always brute forces, "ivf" always uses the approximate index,
+# "auto" switches to ivf once the gallery reaches FACE_ANN_MIN_SIZE faces
+FACE_INDEX_KIND = os.environ.get("FACE_INDEX", "auto").lower()
+FACE_ANN_MIN_SIZE = int(os.environ.get("FACE_ANN_MIN_SIZE", "20000"))
+# recall/latency knob: number of inverted lists scanned per query (higher = better recall, slower)
+FACE_IVF_NPROBE = int(os.environ.get("FACE_IVF_NPROBE", "8"))
+# number of inverted lists, 0 picks ~sqrt(gallery size)
+FACE_IVF_NLIST = int(os.environ.get("FACE_IVF_NLIST", "0"))
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+ASSIGN_CHUNK_SIZE = 16384
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """L2 normalize rows as contiguous float32, zero vectors are left as zeros (similarity 0)."""
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    if embeddings.flags.c_contiguous and np.allclose(norms, 1.0, atol=1e-5):
+        # already normalized (the embedding cache is), so a memory-mapped cache stays
+        # one shared read only mapping instead of becoming a private copy per worker
+        return embeddings
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(embeddings / norms)
+
+
+@dataclass(frozen=True)
+class FaceMatch:
+    label: str
+    similarity: float
+
+    def to_dict(self) -> dict:
+        return {"shopper": self.label, "similarity": round(self.similarity, 4)}
+
+
+class FaceGallery:
+    """Enrolled face embeddings as one normalized (n, d) float32 matrix + a parallel label array.
+
+    Cosine similarity against the whole gallery is a single matrix-vector product.
+    """
+
+    def __init__(self, labels: List[str], embeddings: Optional[np.ndarray] = None):
+        self.labels = list(labels)
+        if embeddings is None or len(self.labels) == 0:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            self.matrix = normalize_embeddings(embeddings)
+        if len(self.matrix) != len(self.labels):
+            raise ValueError(f"Got {len(self.labels)} labels for {len(self.matrix)} embeddings")
+
+    @classmethod
+    def from_encodings(cls, encodings: Dict[str, np.ndarray]) -> "FaceGallery":
+        if not encodings:
+            return cls([])
+        return cls(list(encodings.keys()), np.stack(list(encodings.values())))
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1] if len(self) else 0
+
+    def similarities(self, embedding: np.ndarray) -> np.ndarray:
+        query = normalize_embeddings(embedding)[0]
+        return self.matrix @ query
+
+    def search(self, embedding: np.ndarray, k: int = 1) -> List[FaceMatch]:
+        """Top k gallery entries by cosine similarity, best first."""
+        if not len(self):
+            return []
+        scores = self.similarities(embedding)
+        return [FaceMatch(self.labels[i], float(scores[i])) for i in _top_k(scores, k)]
+
+    def add(self, label: str, embedding: np.ndarray) -> None:
+        row = normalize_embeddings(embedding)
+        self.matrix = row if not len(self) else np.ascontiguousarray(np.vstack([self.matrix, row]))
+        self.labels.append(label)
+
+    def copy_with(self, add: Sequence[Tuple[str, np.ndarray]] = (), remove: Collection[str] = ()):
+        """New gallery with `remove` labels dropped and `add` entries appended, this one is left untouched.
+
+        Goes through build_face_index, so a gallery enrolled past FACE_ANN_MIN_SIZE comes back as an IVFFaceIndex.
+        """
+        keep = [i for i, label in enumerate(self.labels) if label not in remove]
+        labels = [self.labels[i] for i in keep] + [label for label, _ in add]
+        rows = [self.matrix[keep]] if keep else []
+        rows += [normalize_embeddings(embedding) for _, embedding in add]
+        return build_face_index(labels, np.vstack(rows) if rows else None)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the k highest scores, best first."""
+    k = max(1, min(k, len(scores)))
+    if k < len(scores):
+        top = np.argpartition(scores, -k)[-k:]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def _assign_lists(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by cosine) for each row, chunked to bound the (chunk, nlist) score matrix."""
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), ASSIGN_CHUNK_SIZE):
+        chunk = embeddings[start:start + ASSIGN_CHUNK_SIZE]
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(embeddings: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on (a sample of) normalized embeddings."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(embeddings), nlist * KMEANS_SAMPLES_PER_LIST)
+    sample = embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = _assign_lists(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        non_empty = counts > 0
+        sums = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+        centroids[non_empty] = normalize_embeddings(sums)
+        # restart empty lists from random points so every list stays in use
+        empty = np.flatnonzero(~non_empty)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+    return centroids
+
+
+class IVFFaceIndex:
+    """Approximate face gallery: an inverted file over spherical k-means lists.
+
+    A query scores the nlist centroids, then exactly scores only the faces in the
+    nprobe closest lists. Similarities are the same cosine values FaceGallery returns,
+    so SIMILARITY_THRESHOLD means the same thing, only some true neighbours may be missed.
+
+    Indexes made by copy_with share one row buffer. Rows an index can see are never rewritten,
+    and an index only appends in place while nothing sharing the buffer has written past its
+    size (_buffer_claim), otherwise it first moves its rows to a buffer of its own.
+    """
+
+    def __init__(self, labels: List[str], embeddings: np.ndarray, nlist: int = FACE_IVF_NLIST, nprobe: int = FACE_IVF_NPROBE, seed: int = 0):
+        if len(labels) == 0:
+            raise ValueError("IVFFaceIndex needs embeddings to train on, use FaceGallery for an empty gallery")
+        self.nprobe = nprobe
+        self.seed = seed
+        self._requested_nlist = nlist
+        self._build(list(labels), normalize_embeddings(embeddings))
+
+    def _build(self, labels: List[str], matrix: np.ndarray) -> None:
+        nlist = self._requested_nlist or int(np.sqrt(len(matrix)))
+        nlist = max(1, min(nlist, len(matrix)))
+        self.centroids = train_centroids(matrix, nlist, self.seed)
+        assignments = _assign_lists(matrix, self.centroids)
+        order = np.argsort(assignments, kind="stable").astype(np.int32)
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=nlist))))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+        # rows are kept in a growable buffer so inserts are amortized O(d), removed rows
+        # stay in the buffer (dropped from their list) until the next retrain compacts them
+        self._buffer = matrix
+        # [rows written into _buffer by any index sharing it], see the class docstring
+        self._buffer_claim = [len(matrix)]
+        self._size = len(matrix)
+        self._row_labels = labels
+        self.trained_size = len(matrix)
+
+    def _live_rows(self) -> np.ndarray:
+        return np.sort(np.concatenate(self.lists)) if self.lists else np.zeros(0, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.lists)
+
+    @property
+    def labels(self) -> List[str]:
+        return [self._row_labels[i] for i in self._live_rows()]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._buffer[self._live_rows()]
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def dim(self) -> int:
+        return self._buffer.shape[1]
+
+    def search(self, embedding: np.ndarray, k: int = 1, nprobe: Optional[int] = None) -> List[FaceMatch]:
+        query = normalize_embeddings(embedding)[0]
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        probe = _top_k(self.centroids @ query, nprobe)
+        candidates = np.concatenate([self.lists[i] for i in probe])
+        if not len(candidates):
+            return []
+        scores = self._buffer[candidates] @ query
+        return [FaceMatch(self._row_labels[candidates[i]], float(scores[i])) for i in _top_k(scores, k)]
+
+    def add(self, label: str, embedding: np.ndarray) -> None:
+        """Insert one face into its nearest list, retraining once the gallery has 4x'd since the last training."""
+        row = normalize_embeddings(embedding)
+        if self._size == len(self._buffer) or self._buffer_claim[0] != self._size:
+            # full, or another index sharing the buffer already wrote past our rows
+            grown = np.empty((max(1, 2 * self._size), self.dim), dtype=np.float32)
+            grown[:self._size] = self._buffer[:self._size]
+            self._buffer = grown
+            self._buffer_claim = [self._size]
+        # write the row + label before publishing its id in a list so concurrent searches never see a partial entry
+        row_id = self._size
+        self._buffer[row_id] = row[0]
+        self._row_labels.append(label)
+        self._size += 1
+        self._buffer_claim[0] = self._size
+        list_id = int(np.argmax(self.centroids @ row[0]))
+        self.lists[list_id] = np.append(self.lists[list_id], np.int32(row_id))
+
+        if self._size >= 4 * self.trained_size:
+            live_rows = self._live_rows()
+            self._build([self._row_labels[i] for i in live_rows], self._buffer[live_rows])
+
+    def copy_with(self, add: Sequence[Tuple[str, np.ndarray]] = (), remove: Collection[str] = ()) -> "IVFFaceIndex":
+        """New index with `remove` labels dropped and `add` entries inserted, this one is left untouched.
+
+        Centroids and the row buffer are shared: the copy only writes rows past this index's
+        size, which this index never reads, and lists are replaced rather than modified.
+        Dropping below FACE_ANN_MIN_SIZE keeps the index approximate, it is built exact again on the next start.
+        """
+        updated = copy.copy(self)
+        updated._row_labels = list(self._row_labels)
+        updated.lists = list(self.lists)
+        if remove:
+            removed_rows = np.array([i for i, label in enumerate(self._row_labels) if label in remove], dtype=np.int32)
+            for list_id, ids in enumerate(updated.lists):
+                dropped = np.isin(ids, removed_rows)
+                if dropped.any():
+                    updated.lists[list_id] = ids[~dropped]
+        for label, embedding in add:
+            updated.add(label, embedding)
+        return updated
+
+
+def build_face_index(labels: List[str], embeddings: Optional[np.ndarray], kind: str = FACE_INDEX_KIND):
+    """Exact FaceGallery or IVFFaceIndex depending on FACE_INDEX + gallery size, both share the search/add interface."""
+    size = len(labels)
+    use_ivf = kind == "ivf" or (kind == "auto" and size >= FACE_ANN_MIN_SIZE)
+    if use_ivf and size:
+        return IVFFaceIndex(labels, embeddings)
+    return FaceGallery(labels, embeddings)
@@ -0,0 +1,190 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Callable, List, Optional
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+# tensorflow releases the gil for the heavy ops, so threads give real parallelism
+# without paying for a copy of the model per process
+FACE_INFERENCE_WORKERS = int(os.environ.get("FACE_INFERENCE_WORKERS", "2"))
+# requests allowed to wait for a worker, anything past this gets a 503 right away
+FACE_INFERENCE_QUEUE_SIZE = int(os.environ.get("FACE_INFERENCE_QUEUE_SIZE", "8"))
+INFERENCE_RETRY_AFTER_SECONDS = 1
+LATENCY_WINDOW = 1024
+# concurrent requests are grouped into one forward pass of up to FACE_BATCH_MAX_SIZE images,
+# waiting at most FACE_BATCH_MAX_DELAY_MS for the batch to fill (size 1 turns batching off)
+FACE_BATCH_MAX_SIZE = int(os.environ.get("FACE_BATCH_MAX_SIZE", "8"))
+FACE_BATCH_MAX_DELAY_MS = float(os.environ.get("FACE_BATCH_MAX_DELAY_MS", "10"))
+
+
+class InferenceQueueFull(Exception):
+    pass
+
+
+class InferencePool:
+    """Bounded thread pool that keeps blocking model calls off the event loop.
+
+    At most `workers` inferences run at once and at most `max_queue` more wait,
+    past that `run` fails fast with InferenceQueueFull instead of growing a backlog.
+    """
+
+    def __init__(self, workers: int = FACE_INFERENCE_WORKERS, max_queue: int = FACE_INFERENCE_QUEUE_SIZE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="face-inference")
+        self._lock = threading.Lock()
+        # counted until the worker finishes, not until the caller stops waiting,
+        # so disconnected clients can't let more work pile up than the limit
+        self._pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_ms = deque(maxlen=LATENCY_WINDOW)
+        self._inference_ms = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise InferenceQueueFull(f"{self._pending} face inferences already pending")
+            self._pending += 1
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn: Callable, *args):
+        self._acquire()
+        queued_at = time.perf_counter()
+
+        def timed_call():
+            started_at = time.perf_counter()
+            try:
+                result = fn(*args)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finished_at = time.perf_counter()
+            with self._lock:
+                self.completed += 1
+                self._wait_ms.append((started_at - queued_at) * 1000)
+                self._inference_ms.append((finished_at - started_at) * 1000)
+            return result
+
+        try:
+            future = self._executor.submit(timed_call)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending
+            wait_ms = np.array(self._wait_ms)
+            inference_ms = np.array(self._inference_ms)
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(pending, self.workers),
+            "queue_depth": max(0, pending - self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "queue_wait_ms": _summarize(wait_ms),
+            "inference_ms": _summarize(inference_ms),
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _summarize(latencies: np.ndarray) -> dict:
+    if not len(latencies):
+        return {"p50": None, "p99": None, "mean": None}
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {"p50": round(float(p50), 2), "p99": round(float(p99), 2), "mean": round(float(latencies.mean()), 2)}
+
+
+class MicroBatcher:
+    """Collects concurrent single item requests into batches for one model call.
+
+    A batch runs on the inference pool as soon as it has max_size items, or
+    max_delay_ms after its first item arrived. batch_fn takes a list of items and
+    returns one result per item, results are fanned back to each waiting caller.
+    """
+
+    def __init__(self, batch_fn: Callable[[list], list], pool: InferencePool, max_size: int = FACE_BATCH_MAX_SIZE, max_delay_ms: float = FACE_BATCH_MAX_DELAY_MS):
+        self.batch_fn = batch_fn
+        self.pool = pool
+        self.max_size = max(1, max_size)
+        self.max_delay = max_delay_ms / 1000
+        self._items: list = []
+        self._futures: List[asyncio.Future] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.batched_items = 0
+        # keep a reference to running batches so they aren't garbage collected mid flight
+        self._running: set = set()
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._items.append(item)
+        self._futures.append(future)
+        if len(self._items) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._items:
+            return
+        items, futures = self._items, self._futures
+        self._items, self._futures = [], []
+        task = asyncio.ensure_future(self._run_batch(items, futures))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, items: list, futures: List[asyncio.Future]) -> None:
+        self.batches += 1
+        self.batched_items += len(items)
+        try:
+            results = await self.pool.run(self.batch_fn, items)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_size,
+            "max_delay_ms": self.max_delay * 1000,
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched_items / self.batches, 2) if self.batches else None,
+            "pending": len(self._items),
+        }
+
+
+inference_pool = InferencePool()
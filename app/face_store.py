@@ -0,0 +1,251 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable, Collection, Dict, List, Optional, Sequence, Tuple
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+import numpy as np
+
+from app.face_index import normalize_embeddings
+
+_logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_DIR = Path(os.environ.get("FACE_EMBEDDING_CACHE_DIR", "app/face_cache"))
+FACE_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg")
+
+
+def get_image_label(filename: str) -> str:
+    return os.path.splitext(filename)[0].replace("_", " ").title()
+
+
+def hash_file(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+@dataclass
+class EmbeddingEntry:
+    filename: str
+    label: str
+    sha1: str
+    # stat is only used to skip re-hashing unchanged files, the hash is the real key
+    size: int
+    mtime_ns: int
+
+
+class EmbeddingStore:
+    """Gallery embeddings persisted as a normalized float32 .npy + a json manifest.
+
+    Files are keyed by model + detector so switching either never reuses stale
+    embeddings, and rows are keyed by image content hash so only new or changed
+    images are re-embedded. The matrix is memory mapped read only, so every worker
+    loading an unchanged gallery shares the same pages and starts in milliseconds.
+
+    Every save writes a new, uniquely named .npy and then swaps the manifest
+    pointing at it in, so the manifest swap is the single commit point: a reader
+    always gets labels and rows from the same save, never new rows with old labels.
+    """
+
+    def __init__(self, model_name: str, detector_backend: str, cache_dir: Path = EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.cache_dir = Path(cache_dir)
+        self.key = f"{model_name}-{detector_backend}".lower()
+        self.manifest_path = self.cache_dir / f"manifest-{self.key}.json"
+        self.lock_path = self.cache_dir / f".{self.key}.lock"
+
+    @contextmanager
+    def locked(self):
+        """Exclusive lock across workers for read-modify-write updates of the cache files."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def manifest_version(self) -> Optional[Tuple[int, int, int]]:
+        """Changes whenever the cache is rewritten (by any worker), None if there is no cache yet."""
+        try:
+            stat = self.manifest_path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _data_files(self) -> List[Path]:
+        # versioned files are embeddings-<key>.<token>.npy, plus the unversioned file of older caches
+        return [*self.cache_dir.glob(f"embeddings-{self.key}.*.npy"), self.cache_dir / f"embeddings-{self.key}.npy"]
+
+    def _load(self) -> Tuple[List[EmbeddingEntry], Optional[np.ndarray], List[EmbeddingEntry]]:
+        """(entries, embeddings, no face entries), entries[i] is the label of embeddings[i]."""
+        for _ in range(3):
+            try:
+                manifest = json.loads(self.manifest_path.read_text())
+                no_face = [EmbeddingEntry(**entry) for entry in manifest.get("no_face", [])]
+                if manifest["embeddings_file"] is None:
+                    return [], None, no_face
+                embeddings = np.load(self.cache_dir / manifest["embeddings_file"], mmap_mode="r")
+            except FileNotFoundError as e:
+                # the manifest may have been swapped (and the file it named removed) since it was read
+                _logger.debug(f"No usable embedding cache at {self.cache_dir}: {e}")
+                if not self.manifest_path.exists():
+                    break
+                continue
+            except (KeyError, ValueError) as e:
+                _logger.debug(f"No usable embedding cache at {self.cache_dir}: {e}")
+                break
+            entries = [EmbeddingEntry(**entry) for entry in manifest["entries"]]
+            if len(entries) != len(embeddings):
+                _logger.warning(f"Embedding cache manifest {self.manifest_path} does not match its embeddings, ignoring it")
+                break
+            return entries, embeddings, no_face
+        return [], None, []
+
+    def load(self) -> Tuple[List[EmbeddingEntry], Optional[np.ndarray]]:
+        entries, embeddings, _ = self._load()
+        return entries, embeddings
+
+    def save(self, entries: List[EmbeddingEntry], embeddings: Optional[np.ndarray], no_face: Sequence[EmbeddingEntry] = ()) -> None:
+        """Write a new cache version, no_face records images without a detectable face so they aren't re-embedded."""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            embeddings_file = None
+            if entries:
+                # a fresh name per save, nothing reads it until the manifest points at it
+                embeddings_file = f"embeddings-{self.key}.{uuid.uuid4().hex}.npy"
+                with open(self.cache_dir / embeddings_file, "wb") as f:
+                    np.save(f, np.ascontiguousarray(embeddings, dtype=np.float32))
+            tmp_manifest = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_manifest.write_text(json.dumps({
+                "model_name": self.model_name,
+                "detector_backend": self.detector_backend,
+                "embeddings_file": embeddings_file,
+                "entries": [asdict(entry) for entry in entries],
+                "no_face": [asdict(entry) for entry in no_face],
+            }))
+            os.replace(tmp_manifest, self.manifest_path)
+            # workers still mapping an older file keep their (consistent) pages after the unlink
+            for path in self._data_files():
+                if path.name != embeddings_file:
+                    path.unlink(missing_ok=True)
+        except OSError as e:
+            # a read only deploy still works, it just re-embeds on the next start
+            _logger.warning(f"Could not write embedding cache to {self.cache_dir}: {e}")
+
+    def clear(self) -> None:
+        for path in (self.manifest_path, *self._data_files()):
+            path.unlink(missing_ok=True)
+
+    def _scan(
+        self,
+        image_dir: Path,
+        cache: Tuple[List[EmbeddingEntry], Optional[np.ndarray], List[EmbeddingEntry]],
+        embed: Callable[[Path], Optional[np.ndarray]],
+        fresh: Dict[str, Optional[np.ndarray]],
+        failed: set,
+    ) -> Tuple[List[EmbeddingEntry], List[np.ndarray], List[EmbeddingEntry]]:
+        """(entries, rows, no face entries) for image_dir, rows come from the cache or from fresh (sha1 -> embedding, filled in here)."""
+        entries, embeddings, no_face = cache
+        cached: Dict[str, int] = {entry.sha1: row for row, entry in enumerate(entries)}
+        no_face_hashes = {entry.sha1 for entry in no_face}
+        cached_by_name = {entry.filename: entry for entry in [*entries, *no_face]}
+
+        new_entries: List[EmbeddingEntry] = []
+        new_no_face: List[EmbeddingEntry] = []
+        rows: List[np.ndarray] = []
+        for filename in sorted(os.listdir(image_dir)):
+            if not filename.lower().endswith(FACE_IMAGE_SUFFIXES):
+                continue
+            path = Path(image_dir) / filename
+            try:
+                stat = path.stat()
+                previous = cached_by_name.get(filename)
+                if previous is not None and (previous.size, previous.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                    sha1 = previous.sha1
+                else:
+                    sha1 = hash_file(path)
+            except FileNotFoundError:
+                # deleted while scanning
+                continue
+            entry = EmbeddingEntry(filename, get_image_label(filename), sha1, stat.st_size, stat.st_mtime_ns)
+
+            if sha1 in cached:
+                row = embeddings[cached[sha1]]
+            elif sha1 in no_face_hashes:
+                new_no_face.append(entry)
+                continue
+            elif sha1 in failed:
+                continue
+            else:
+                if sha1 not in fresh:
+                    try:
+                        fresh[sha1] = embed(path)
+                    except Exception as e:
+                        # not recorded at all (unlike a missing face), so it is retried on the next start
+                        _logger.warning(f"Could not embed {filename}, skipping it: {e}")
+                        failed.add(sha1)
+                        continue
+                    _logger.debug(f"  {'No face found in' if fresh[sha1] is None else 'Indexed'}: {filename}")
+                if fresh[sha1] is None:
+                    # remembered (without a row) so it isn't re-hashed and re-detected on every start
+                    new_no_face.append(entry)
+                    continue
+                row = normalize_embeddings(fresh[sha1])[0]
+            new_entries.append(entry)
+            rows.append(row)
+        return new_entries, rows, new_no_face
+
+    def sync(self, image_dir: Path, embed: Callable[[Path], Optional[np.ndarray]]) -> Tuple[List[EmbeddingEntry], Optional[np.ndarray]]:
+        """Entries + embeddings for every face image in image_dir, embedding only new/changed images."""
+        cache = self._load()
+        fresh: Dict[str, Optional[np.ndarray]] = {}
+        failed: set = set()
+        # embed without holding the lock, it can take a while
+        new_entries, rows, new_no_face = self._scan(image_dir, cache, embed, fresh, failed)
+        if new_entries == cache[0] and new_no_face == cache[2]:
+            # unchanged gallery - hand back the shared read only mapping as is
+            return cache[0], cache[1]
+
+        try:
+            with self.locked():
+                # another worker may have enrolled or deleted a shopper since the first read, rescan
+                # against the current cache so that change isn't overwritten (only new images embed here)
+                cache = self._load()
+                new_entries, rows, new_no_face = self._scan(image_dir, cache, embed, fresh, failed)
+                if new_entries == cache[0] and new_no_face == cache[2]:
+                    return cache[0], cache[1]
+                _logger.debug(f"Embedded {len(fresh)} new/changed image(s), {len(failed)} failed")
+                matrix = np.stack(rows).astype(np.float32) if rows else None
+                if new_entries or new_no_face:
+                    self.save(new_entries, matrix, new_no_face)
+                else:
+                    # every image was removed, don't leave the old gallery behind
+                    self.clear()
+                return new_entries, matrix
+        except OSError as e:
+            _logger.warning(f"Could not lock embedding cache in {self.cache_dir}: {e}")
+        return new_entries, np.stack(rows).astype(np.float32) if rows else None
+
+    def update(self, upserts: Sequence[Tuple[EmbeddingEntry, np.ndarray]] = (), remove_filenames: Collection[str] = ()) -> List[EmbeddingEntry]:
+        """Add/replace/remove single entries without touching (or re-embedding) the rest of the gallery.
+
+        A new version of the files is written and swapped in, so workers still mapping the old
+        file keep a consistent (old) view until they reload.
+        """
+        with self.locked():
+            entries, embeddings, no_face = self._load()
+            replaced = set(remove_filenames) | {entry.filename for entry, _ in upserts}
+            keep = [row for row, entry in enumerate(entries) if entry.filename not in replaced]
+            new_entries = [entries[row] for row in keep] + [entry for entry, _ in upserts]
+            new_no_face = [entry for entry in no_face if entry.filename not in replaced]
+            rows = ([np.asarray(embeddings[keep])] if keep else []) + [normalize_embeddings(embedding) for _, embedding in upserts]
+            if rows or new_no_face:
+                self.save(new_entries, np.vstack(rows) if rows else None, new_no_face)
+            else:
+                self.clear()
+            return new_entries
@@ -0,0 +1,91 @@
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+import os
+import time
+
+# a face is the "same" face while its box overlaps the tracked box by at least this much
+FACE_TRACK_IOU_THRESHOLD = float(os.environ.get("FACE_TRACK_IOU_THRESHOLD", "0.5"))
+# re-embed a tracked face anyway after this many frames / seconds, in case someone swapped in
+FACE_TRACK_REFRESH_FRAMES = int(os.environ.get("FACE_TRACK_REFRESH_FRAMES", "30"))
+FACE_TRACK_REFRESH_SECONDS = float(os.environ.get("FACE_TRACK_REFRESH_SECONDS", "5"))
+
+Box = Tuple[int, int, int, int]  # x, y, w, h
+Eyes = Tuple[Tuple[int, int], Tuple[int, int]]  # left, right (of the person, not the observer)
+
+
+def get_box(facial_area: dict) -> Box:
+    return (int(facial_area["x"]), int(facial_area["y"]), int(facial_area["w"]), int(facial_area["h"]))
+
+
+def get_eyes(facial_area: dict) -> Optional[Eyes]:
+    left, right = facial_area.get("left_eye"), facial_area.get("right_eye")
+    if left is None or right is None:
+        return None
+    return ((int(left[0]), int(left[1])), (int(right[0]), int(right[1])))
+
+
+def iou(a: Box, b: Box) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    overlap_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    overlap_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = overlap_w * overlap_h
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+@dataclass
+class FaceTrack:
+    box: Box
+    embedded_at: float = field(default_factory=time.monotonic)
+    frames_since_embedding: int = 0
+    result: Optional[dict] = None
+
+
+class FaceTracker:
+    """Follows the main (largest) face across a camera stream and decides when it needs re-embedding.
+
+    Detection is cheap next to embedding, so every frame is detected but the face is only
+    re-embedded when it is new, its box jumps (iou drop) or the periodic refresh is due.
+    """
+
+    def __init__(
+        self,
+        iou_threshold: float = FACE_TRACK_IOU_THRESHOLD,
+        refresh_frames: int = FACE_TRACK_REFRESH_FRAMES,
+        refresh_seconds: float = FACE_TRACK_REFRESH_SECONDS,
+    ):
+        self.iou_threshold = iou_threshold
+        self.refresh_frames = refresh_frames
+        self.refresh_seconds = refresh_seconds
+        self.track: Optional[FaceTrack] = None
+        self.frames = 0
+        self.embeddings = 0
+
+    def update(self, boxes: List[Box]) -> Tuple[Optional[Box], bool]:
+        """Feed one frame's detections, returns (tracked box or None, whether to re-embed it)."""
+        self.frames += 1
+        if not boxes:
+            self.track = None
+            return None, False
+
+        box = max(boxes, key=lambda b: b[2] * b[3])
+        track = self.track
+        if (
+            track is None
+            or iou(track.box, box) < self.iou_threshold
+            or track.frames_since_embedding >= self.refresh_frames
+            or time.monotonic() - track.embedded_at >= self.refresh_seconds
+        ):
+            return box, True
+
+        track.box = box
+        track.frames_since_embedding += 1
+        return box, False
+
+    def mark_embedded(self, box: Box, result: dict) -> None:
+        self.embeddings += 1
+        self.track = FaceTrack(box, result=result)
+
+    def stats(self) -> dict:
+        return {"frames": self.frames, "embeddings": self.embeddings}
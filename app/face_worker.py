@@ -0,0 +1,88 @@
+"""Out of process face inference (FACE_MODE=worker).
+
+Holds the deepface models so the web workers never import tensorflow, they forward
+detection/embedding calls here over a unix socket.
+
+python -m app.face_worker
+"""
+from pathlib import Path
+import logging
+import os
+import socketserver
+
+import numpy as np
+
+from app.face_backend import InProcessFaceBackend, FACE_WORKER_SOCKET, receive_message, send_message
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+_logger = logging.getLogger(__name__)
+
+backend = InProcessFaceBackend()
+
+
+def handle_call(op: str, args: dict, arrays: list):
+    """Returns (json result, result arrays) for one request."""
+    if op == "warmup":
+        backend.warmup()
+        return None, []
+    if op == "embed_image_file":
+        embedding = backend.embed_image_file(Path(args["path"]))
+        return None, [] if embedding is None else [embedding]
+    if op == "represent_images":
+        # embeddings are plain float lists already, results go back as json
+        return _to_json(backend.represent_images(list(arrays))), []
+    if op == "detect_faces":
+        return [[list(box), eyes] for box, eyes in backend.detect_faces(arrays[0])], []
+    if op == "represent_face":
+        eyes = args.get("eyes")
+        return None, [backend.represent_face(arrays[0], tuple(args["box"]), tuple(map(tuple, eyes)) if eyes else None)]
+    raise ValueError(f"Unknown face worker op {op}")
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class FaceWorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # one connection per web worker thread, serve its calls until it disconnects
+        while True:
+            try:
+                header, arrays = receive_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                result, result_arrays = handle_call(header["op"], header.get("args", {}), arrays)
+                send_message(self.request, {"ok": True, "result": result}, result_arrays)
+            except Exception as e:
+                _logger.exception(f"Face worker call {header.get('op')} failed")
+                send_message(self.request, {"ok": False, "error": str(e)})
+
+
+class FaceWorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path: str = FACE_WORKER_SOCKET):
+    if os.path.exists(path):
+        os.unlink(path)
+    backend.warmup()
+    with FaceWorkerServer(path, FaceWorkerHandler) as server:
+        # only this user (the web workers) may connect
+        os.chmod(path, 0o600)
+        _logger.info(f"Face worker listening on {path}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,22 +1,32 @@
-from fastapi import APIRouter, FastAPI, UploadFile, File, HTTPException, Header, Request
+from fastapi import APIRouter, Depends, FastAPI, UploadFile, File, Form, HTTPException, Header, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dataclasses import dataclass
-from contextlib import asynccontextmanager
-
-from deepface import DeepFace
+from contextlib import asynccontextmanager, suppress
+
+from app.face_index import FaceGallery, IVFFaceIndex, build_face_index
+from app.face_backend import face_backend, FaceWorkerError, MODEL_NAME, DETECTOR_BACKEND, FACE_WARMUP
+from app.face_store import EmbeddingStore, EmbeddingEntry, FACE_IMAGE_SUFFIXES, get_image_label
+from app.face_inference import inference_pool, MicroBatcher, InferenceQueueFull, INFERENCE_RETRY_AFTER_SECONDS
+from app.face_images import decode_image, decode_raw_frame, raw_frame_size, InvalidImage
+from app.face_tracking import FaceTracker, Box, Eyes
+from app.versioned_state import VersionedState
+from app.frame_cache import frame_cache, dhash
+from app.unmatched_faces import unmatched_faces
+from app.rate_limit import create_rate_limiter
+from app.metrics import timed, instrument_templates, register_cache
 import numpy as np
+import asyncio
+import hashlib
+import json
+import re
 import os
 from pathlib import Path
-import tempfile
-import uuid
 import datetime
-import time
-from collections import defaultdict
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 
 logging.basicConfig(
@@ -27,90 +37,156 @@ _logger = logging.getLogger(__name__)
 API_PASSWORD = os.environ.get("FACE_API_PASSWORD", "")
 RATE_LIMIT = 10 # per minute (window)
 RATE_WINDOW = 60
-request_history: defaultdict = defaultdict(list)
+rate_limiter = create_rate_limiter(RATE_LIMIT, RATE_WINDOW)
 
 SHOPPERS_DIR = Path(f"app/static/face_db")
 SIMILARITY_THRESHOLD = 0.4  # DeepFace cosine similarity: higher = more similar
 TARGET_SIZE = (224, 224)  # Standard input size for face recognition models
-
-face_encodings: Dict[str, np.ndarray] = {}
-unmatched_faces: List[Dict] = []
-current_shopper: str = None
+embedding_store = EmbeddingStore(MODEL_NAME, DETECTOR_BACKEND)
+
+face_gallery: Union[FaceGallery, IVFFaceIndex] = FaceGallery([])
+# enrollments in any worker rewrite the shared embedding cache, the other workers
+# pick the change up by checking the cache manifest this often
+FACE_GALLERY_SYNC_SECONDS = float(os.environ.get("FACE_GALLERY_SYNC_SECONDS", "2"))
+_gallery_lock = asyncio.Lock()
+_seen_manifest_version = None
+# filename -> cache entry for every face in face_gallery, diffed against the cache manifest on sync
+_gallery_entries: Dict[str, EmbeddingEntry] = {}
+_face_ready_task: Optional[asyncio.Future] = None
+MAX_TOP_K = 10
+MAX_UNMATCHED_PAGE_SIZE = 500
+# versioned so display clients can wait for a change (long poll / sse) instead of polling
+current_shopper = VersionedState()
+# long polls / sse streams are held at most this long before returning / sending a keepalive
+SHOPPER_WAIT_MAX_SECONDS = 30
+
+def embed_face_image(path: Path) -> Optional[np.ndarray]:
+    return face_backend.embed_image_file(path)
+
+def _set_gallery(gallery, entries: Dict[str, EmbeddingEntry]) -> None:
+    """Swap in a new gallery, searches already running keep using the one they started with."""
+    global face_gallery, _gallery_entries
+    face_gallery = gallery
+    _gallery_entries = entries
+    frame_cache.clear()
+
+def reload_face_index_from_store():
+    """Apply what another worker changed in the shared embedding cache to the gallery (no embedding, no retraining)."""
+    global _seen_manifest_version
+    # read before loading, a write racing the load just shows up as another (empty) diff
+    _seen_manifest_version = embedding_store.manifest_version()
+    entries, embeddings = embedding_store.load()
+    previous = {(entry.filename, entry.sha1) for entry in _gallery_entries.values()}
+    current = {(entry.filename, entry.sha1) for entry in entries}
+    # the gallery is keyed by label, so a label with any changed image is re-added whole
+    changed = {entry.label for entry in _gallery_entries.values() if (entry.filename, entry.sha1) not in current}
+    changed |= {entry.label for entry in entries if (entry.filename, entry.sha1) not in previous}
+    if not changed:
+        return
+    add = [(entry.label, embeddings[row]) for row, entry in enumerate(entries) if entry.label in changed]
+    _set_gallery(face_gallery.copy_with(add=add, remove=changed), {entry.filename: entry for entry in entries})
+    _logger.info(f"Updated {len(changed)} shopper(s) from the embedding cache, {len(face_gallery)} face(s) indexed")
+
+def _face_index_loaded() -> bool:
+    task = _face_ready_task
+    return task is not None and task.done() and not task.cancelled() and task.exception() is None
+
+async def sync_gallery_with_other_workers():
+    while True:
+        await asyncio.sleep(FACE_GALLERY_SYNC_SECONDS)
+        if not _face_index_loaded() or embedding_store.manifest_version() == _seen_manifest_version:
+            continue
+        async with _gallery_lock:
+            try:
+                await asyncio.to_thread(reload_face_index_from_store)
+            except Exception:
+                _logger.exception("Failed to reload the face gallery")
 
 def load_face_index():
-    """Load face encodings from image files on disk at startup."""
-    global face_encodings
+    """Load face encodings for the images on disk at startup, only new/changed images are embedded."""
+    global face_gallery, _seen_manifest_version
 
     if not os.path.exists(SHOPPERS_DIR):
         os.makedirs(SHOPPERS_DIR, exist_ok=True)
         _logger.debug(f"Created empty shoppers directory: {SHOPPERS_DIR}")
         return
 
-    for filename in os.listdir(SHOPPERS_DIR):
-        if filename.lower().endswith((".png", ".jpg", ".jpeg")):
-            filepath = os.path.join(SHOPPERS_DIR, filename)
-            try:
-                embedding = DeepFace.represent(
-                    img_path=filepath,
-                    model_name="Facenet512",
-                    detector_backend="mtcnn",
-                    align=True,
-                    enforce_detection=False
-                )
-                if embedding:
-                    shopper_category = os.path.splitext(filename)[0].replace("_", " ").title()
-                    face_encodings[shopper_category] = np.array(embedding[0]["embedding"])
-                    _logger.debug(f"  Indexed: {shopper_category}")
-                else:
-                    _logger.debug(f"  No face found in: {filename}")
-            except Exception as e:
-                _logger.debug(f"  Error loading {filename}: {e}")
+    _seen_manifest_version = embedding_store.manifest_version()
+    entries, embeddings = embedding_store.sync(SHOPPERS_DIR, embed_face_image)
+    _set_gallery(build_face_index([entry.label for entry in entries], embeddings), {entry.filename: entry for entry in entries})
+    _logger.debug(f"Loaded {len(face_gallery)} face(s)")
 
-    _logger.debug(f"Loaded {len(face_encodings)} face(s)")
+def represent_images(images: List[np.ndarray]) -> List[list]:
+    """Blocking detection + embedding for a batch of decoded (bgr) images, run on the inference pool."""
+    with timed("face_inference"):
+        return face_backend.represent_images(images)
 
-@asynccontextmanager
-async def startup_event(args):
-    print("Loading face index...")
-    load_face_index()
-    print("Server ready.")
-    yield
+embedding_batcher = MicroBatcher(represent_images, inference_pool)
 
-def _check_rate_limit(client_ip: str) -> bool:
-    """Check if client has exceeded rate limit. Returns True if allowed."""
-    now = time.time()
-    window_start = now - RATE_WINDOW
+def detect_faces(image: np.ndarray) -> List[Tuple[Box, Optional[Eyes]]]:
+    """Blocking face detection only (no embedding), (box, eyes) per face, run on the inference pool."""
+    with timed("face_inference"):
+        return face_backend.detect_faces(image)
 
-    request_history[client_ip] = [
-        ts for ts in request_history[client_ip] if ts > window_start
-    ]
+def represent_face(image: np.ndarray, box: Box, eyes: Optional[Eyes] = None) -> np.ndarray:
+    """Blocking embedding of an already detected (eye aligned) face, skipping a second detection pass."""
+    with timed("face_inference"):
+        return face_backend.represent_face(image, box, eyes)
 
-    if len(request_history[client_ip]) >= RATE_LIMIT:
-        return False
+def _initialize_face_subsystem():
+    load_face_index()
+    if FACE_WARMUP:
+        face_backend.warmup()
+    _logger.info("Face index ready.")
+
+async def ensure_face_ready():
+    """Loads the gallery (and with FACE_WARMUP the model) once, on the first /face request or the warmup task.
 
-    request_history[client_ip].append(now)
-    return True
+    Only a dependency of the routes that need the gallery or the model, so the rest of the site
+    (and the e-ink display's current shopper routes) never waits on, or fails with, face startup.
+    """
+    global _face_ready_task
+    if _face_ready_task is None:
+        _face_ready_task = asyncio.ensure_future(asyncio.to_thread(_initialize_face_subsystem))
+    try:
+        await asyncio.shield(_face_ready_task)
+    except Exception as e:
+        _face_ready_task = None  # let the next request retry
+        _logger.exception("Face subsystem failed to initialize")
+        raise HTTPException(status_code=503, detail=f"Face recognition is unavailable: {e}")
 
+async def _warm_up():
+    # failures are already logged, the first request will retry
+    with suppress(HTTPException):
+        await ensure_face_ready()
 
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    """Compute cosine similarity between two vectors."""
-    dot_product = np.dot(a, b)
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-    return float(dot_product / (norm_a * norm_b))
+@asynccontextmanager
+async def startup_event(args):
+    # nothing face related is loaded here unless FACE_WARMUP is set, so the site starts straight away
+    warmup_task = None
+    if FACE_WARMUP:
+        _logger.info("Warming up face recognition in the background...")
+        warmup_task = asyncio.create_task(_warm_up())
+    gallery_sync_task = asyncio.create_task(sync_gallery_with_other_workers())
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    gallery_sync_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await gallery_sync_task
+    inference_pool.shutdown()
+
+async def _check_rate_limit(client_ip: str) -> bool:
+    """Check if client has exceeded rate limit. Returns True if allowed."""
+    if rate_limiter.blocking:
+        # the shared sqlite limiter can wait on another worker's write lock, keep that off the event loop
+        return await asyncio.to_thread(rate_limiter.allow, client_ip)
+    return rate_limiter.allow(client_ip)
 
 
-def _track_unmatched(closest_match, closest_similarity):
-    """Append an unmatched face entry and return its id."""
-    uid = str(uuid.uuid4())
-    unmatched_faces.append({
-        "id": uid,
-        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-        "closest_match": closest_match,
-        "closest_similarity": closest_similarity,
-    })
-    return uid
+def _track_unmatched(captured_encoding, closest_match, closest_similarity):
+    """Record an unmatched face (and cluster its embedding) and return its id."""
+    return unmatched_faces.add(captured_encoding, closest_match, closest_similarity)
 
 def get_home_page(
         request: Request,
@@ -122,7 +198,11 @@ def get_home_page(
 
 
 router = APIRouter(prefix="/face", lifespan=startup_event)
+# inference and gallery routes only, /face/current-shopper keeps working while the gallery can't load
+_requires_face = [Depends(ensure_face_ready)]
 templates = Jinja2Templates(directory="app/templates")
+instrument_templates(templates)
+register_cache("face_frames", frame_cache.stats)
 
 @router.get("/")
 async def home(
@@ -131,18 +211,7 @@ async def home(
     response = get_home_page(request, templates)
     return response
 
-@router.post("/compare-face")
-async def compare_face(
-    request: Request,
-    file: UploadFile = File(...),
-    x_api_password: Optional[str] = Header(None)
-):
-    """
-    Receive a captured face image, compare against the face index.
-    If no match, track the face as unmatched.
-    Requires password authentication via X-API-Password header.
-    """
-    global current_shopper
+async def _authorize(request: Request, x_api_password: Optional[str]):
     client_ip = request.client.host if request.client else "unknown"
 
     _logger.debug(f"Got Password: {x_api_password}")
@@ -150,110 +219,467 @@ async def compare_face(
     if x_api_password != API_PASSWORD:
         raise HTTPException(status_code=401, detail="Invalid or missing password")
 
-    if not _check_rate_limit(client_ip):
+    if not await _check_rate_limit(client_ip):
         raise HTTPException(status_code=429, detail="Rate limit exceeded. Try again later.")
+
+async def _embed_image(image: np.ndarray) -> list:
+    # inference blocks for a long time, keep it off the event loop so the rest of the site stays responsive
+    try:
+        return await embedding_batcher.submit(image)
+    except InferenceQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Face inference is at capacity. Try again shortly.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER_SECONDS)},
+        )
+    except FaceWorkerError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def _match_embedding(captured_encoding: np.ndarray, top_k: int) -> dict:
+    """Match an embedding against the face index, tracking it as unmatched if there's no match."""
+    gallery = face_gallery
+    if not len(gallery):
+        unmatched_id = _track_unmatched(captured_encoding, None, 0.0)
+        return {
+            "match_found": False,
+            "unmatched_id": unmatched_id,
+            "closest_match": None,
+            "closest_similarity": 0.0,
+            "message": "No face indexed — face tracked as unmatched",
+        }
+
+    with timed("similarity_search"):
+        matches = gallery.search(captured_encoding, k=min(max(top_k, 1), MAX_TOP_K))
+    best_name = matches[0].label
+    best_similarity = matches[0].similarity
+    await current_shopper.set(best_name)
+
+    if best_similarity >= SIMILARITY_THRESHOLD:
+        result = {
+            "match_found": True,
+            "shopper": best_name,
+            "distance": round(1.0 - best_similarity, 4),
+            "confidence": best_similarity,
+        }
+    else:
+        unmatched_id = _track_unmatched(captured_encoding, best_name, best_similarity)
+        result = {
+            "match_found": False,
+            "unmatched_id": unmatched_id,
+            "closest_match": best_name,
+            "closest_similarity": round(best_similarity, 4),
+        }
+    if top_k > 1:
+        result["candidates"] = [match.to_dict() for match in matches]
+    return result
+
+async def _compare_image(image: np.ndarray, top_k: int) -> dict:
+    """Embed a decoded image and match it against the face index, near duplicate frames reuse a cached result."""
     try:
-        img_bytes = await file.read()
-
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-            tmp.write(img_bytes)
-            tmp_path = tmp.name
-
-        try:
-            embedding = DeepFace.represent(
-                img_path=tmp_path,
-                model_name="Facenet512",
-                detector_backend="mtcnn",
-                align=True,
-                enforce_detection=False
-            )
-        finally:
-            os.unlink(tmp_path)
+        # read before embedding, a gallery swap meanwhile clears the cache and this result must not refill it
+        generation = frame_cache.generation
+        frame_hash = dhash(image)
+        cached = frame_cache.get(frame_hash)
+        if cached is not None:
+            if cached.top_k == top_k:
+                await current_shopper.set(cached.result.get("shopper", cached.result.get("closest_match")))
+                return cached.result
+            # same face, different top_k - only the (cheap) matching needs redoing
+            result = await _match_embedding(cached.embedding, top_k)
+            frame_cache.put(frame_hash, cached.embedding, result, top_k, generation)
+            return result
+
+        embedding = await _embed_image(image)
 
         if not embedding:
             raise HTTPException(status_code=400, detail="No face detected in image")
 
         captured_encoding = np.array(embedding[0]["embedding"])
-
-        if not face_encodings:
-            unmatched_id = _track_unmatched(None, 0.0)
-            return {
-                "match_found": False,
-                "unmatched_id": unmatched_id,
-                "closest_match": None,
-                "closest_similarity": 0.0,
-                "message": "No face indexed — face tracked as unmatched",
-            }
-
-        shopper_names = list(face_encodings.keys())
-        similarities = []
-
-        for name in shopper_names:
-            sim = cosine_similarity(captured_encoding, face_encodings[name])
-            similarities.append(sim)
-
-        best_idx = int(np.argmax(similarities))
-        best_similarity = similarities[best_idx]
-        best_name = shopper_names[best_idx]
-        current_shopper = best_name
-
-        if best_similarity >= SIMILARITY_THRESHOLD:
-            return {
-                "match_found": True,
-                "shopper": best_name,
-                "distance": round(1.0 - best_similarity, 4),
-                "confidence": best_similarity,
-            }
-        else:
-            unmatched_id = _track_unmatched(best_name, best_similarity)
-            return {
-                "match_found": False,
-                "unmatched_id": unmatched_id,
-                "closest_match": best_name,
-                "closest_similarity": round(best_similarity, 4),
-            }
+        result = await _match_embedding(captured_encoding, top_k)
+        frame_cache.put(frame_hash, captured_encoding, result, top_k, generation)
+        return result
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/compare-face", dependencies=_requires_face)
+async def compare_face(
+    request: Request,
+    file: UploadFile = File(...),
+    top_k: int = 1,
+    x_api_password: Optional[str] = Header(None)
+):
+    """
+    Receive a captured face image, compare against the face index.
+    If no match, track the face as unmatched.
+    Pass top_k > 1 to also get the k best candidates with their similarities.
+    Requires password authentication via X-API-Password header.
+    """
+    await _authorize(request, x_api_password)
 
+    img_bytes = await file.read()
+    try:
+        # decoded in memory (and downscaled) on a thread, never written to disk
+        image = await asyncio.to_thread(decode_image, img_bytes)
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await _compare_image(image, top_k)
+
+@router.post("/compare-frame", dependencies=_requires_face)
+async def compare_frame(
+    request: Request,
+    width: int,
+    height: int,
+    pixel_format: str = "rgb",
+    top_k: int = 1,
+    x_api_password: Optional[str] = Header(None)
+):
+    """
+    Same as /compare-face for a raw uint8 frame sent as the request body (row major,
+    pixel_format rgb or gray), so edge devices can skip the jpeg encode/decode.
+    Requires password authentication via X-API-Password header.
+    """
+    await _authorize(request, x_api_password)
+
+    try:
+        body = await _read_body(request, raw_frame_size(width, height, pixel_format))
+        image = await asyncio.to_thread(decode_raw_frame, body, width, height, pixel_format)
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await _compare_image(image, top_k)
+
+async def _read_body(request: Request, max_bytes: int) -> bytes:
+    """The request body, refused with a 413 as soon as it is known to be over max_bytes."""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Expected at most {max_bytes} bytes, got {content_length}")
+    body = bytearray()
+    # a chunked (or lying) client has no usable content-length, so count while reading too
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Expected at most {max_bytes} bytes")
+    return bytes(body)
+
+
+
+@router.websocket("/stream", dependencies=_requires_face)
+async def stream_faces(
+    websocket: WebSocket,
+    top_k: int = 1,
+    password: Optional[str] = None,
+):
+    """
+    Continuous camera feed. Send frames as binary messages (jpeg/png, or raw frames after a
+    {"width": .., "height": .., "pixel_format": "rgb"} text message). Every frame is run through
+    detection, but the face is only re-embedded when it's new, moved (iou drop) or due a refresh.
+    Pushes {"type": "match"} results, {"type": "no_face"} when the face leaves and
+    {"type": "current_shopper"} on changes. Frames that arrive while one is still being processed
+    are dropped in favour of the newest. Authenticate with X-API-Password or ?password=.
+    """
+    if websocket.headers.get("x-api-password", password) != API_PASSWORD:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+
+    tracker = FaceTracker()
+    raw_format: Optional[dict] = None
+    latest_frame: Optional[bytes] = None
+    frame_ready = asyncio.Event()
+    dropped = 0
+
+    async def receive_frames():
+        nonlocal raw_format, latest_frame, dropped
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("text") is not None:
+                with suppress(ValueError):
+                    raw_format = json.loads(message["text"]) or None
+            elif message.get("bytes") is not None:
+                if latest_frame is not None:
+                    dropped += 1
+                latest_frame = message["bytes"]
+                frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    sent_version = current_shopper.version
+    shopper_waiter = frame_waiter = None
+    tracking = False
+    try:
+        while True:
+            # wake on a new frame, a shopper change (from any client) or the socket closing
+            if shopper_waiter is None:
+                shopper_waiter = asyncio.create_task(current_shopper.wait_for_change(sent_version, SHOPPER_WAIT_MAX_SECONDS))
+            frame_waiter = asyncio.create_task(frame_ready.wait())
+            await asyncio.wait({receiver, frame_waiter, shopper_waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                break
+            if shopper_waiter.done():
+                shopper_waiter = None
+                if current_shopper.version != sent_version:
+                    sent_version = current_shopper.version
+                    await websocket.send_json({"type": "current_shopper", "shopper_category": str(current_shopper.value), "version": sent_version})
+            if not frame_waiter.done():
+                frame_waiter.cancel()
+                continue
+            frame, latest_frame = latest_frame, None
+            frame_ready.clear()
 
-@router.get("/get-results")
+            try:
+                if raw_format:
+                    image = await asyncio.to_thread(decode_raw_frame, frame, int(raw_format["width"]), int(raw_format["height"]), raw_format.get("pixel_format", "rgb"))
+                else:
+                    image = await asyncio.to_thread(decode_image, frame)
+                faces = dict(await inference_pool.run(detect_faces, image))
+                box, needs_embedding = tracker.update(list(faces))
+                if box is None and tracking:
+                    await websocket.send_json({"type": "no_face", **tracker.stats(), "dropped": dropped})
+                tracking = box is not None
+                if needs_embedding:
+                    embedding = await inference_pool.run(represent_face, image, box, faces[box])
+                    result = await _match_embedding(embedding, top_k)
+                    tracker.mark_embedded(box, result)
+                    await websocket.send_json({"type": "match", **result, "box": list(box), **tracker.stats(), "dropped": dropped})
+            except (InvalidImage, KeyError, ValueError) as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+            except FaceWorkerError as e:
+                # the next frame reconnects to the face worker, keep the stream open
+                await websocket.send_json({"type": "error", "detail": str(e)})
+            except InferenceQueueFull:
+                # skip the frame, the next one will try again
+                dropped += 1
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # one bad frame (or model hiccup) shouldn't end the stream
+                _logger.exception("Face stream frame failed")
+                await websocket.send_json({"type": "error", "detail": str(e) or type(e).__name__})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in (receiver, frame_waiter, shopper_waiter):
+            if task is not None:
+                task.cancel()
+
+
+@router.get("/get-results", dependencies=_requires_face)
 async def get_results():
     """Summary of current state."""
     return {
         "unmatched_faces_count": len(unmatched_faces),
-        "shoppers_indexed": len(face_encodings),
-        "shopper_categories": list(face_encodings.keys()),
+        "shoppers_indexed": len(face_gallery),
+        "shopper_categories": list(face_gallery.labels),
     }
 
 
+@router.get("/inference-stats")
+async def get_inference_stats():
+    """Inference pool queue depth, rejections, latency percentiles, batching and frame cache stats."""
+    return {**inference_pool.stats(), "batching": embedding_batcher.stats(), "frame_cache": frame_cache.stats()}
+
+
+def _parse_timestamp(value: Optional[str], name: str) -> Optional[float]:
+    if value is None:
+        return None
+    # fromisoformat only accepts a trailing Z from python 3.11 (the image runs 3.10)
+    if value[-1:] in ("Z", "z"):
+        value = value[:-1] + "+00:00"
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 timestamp")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.timestamp()
+
 @router.get("/unmatched-faces")
-async def get_unmatched_faces():
-    """Return all tracked unmatched faces."""
-    return {"unmatched_faces": unmatched_faces}
+async def get_unmatched_faces(
+    offset: int = 0,
+    limit: int = 50,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cluster: Optional[int] = None,
+):
+    """Return a page of tracked unmatched faces (newest first), optionally filtered by ISO timestamps / cluster."""
+    return unmatched_faces.page(
+        offset=max(offset, 0),
+        limit=min(max(limit, 1), MAX_UNMATCHED_PAGE_SIZE),
+        since=_parse_timestamp(since, "since"),
+        until=_parse_timestamp(until, "until"),
+        cluster=cluster,
+    )
+
+
+@router.get("/unmatched-clusters")
+async def get_unmatched_clusters(min_count: int = 2, limit: int = 50):
+    """Clusters of repeat unmatched visitors, largest first."""
+    return {"clusters": unmatched_faces.clusters(min_count=min_count, limit=min(max(limit, 1), MAX_UNMATCHED_PAGE_SIZE))}
 
 
-@router.get("/shoppers")
+@router.get("/shoppers", dependencies=_requires_face)
 async def list_shoppers():
     """List indexed shopper categories."""
-    return {"shoppers": list(face_encodings.keys())}
+    return {"shoppers": list(face_gallery.labels)}
 
 
-@router.get("/current-shopper")
-async def list_current_shopper():
-    """List the current/active shopper category to be used in eink display."""
+def _shopper_stem(name: str) -> str:
+    # shoppers are stored as face_db/<stem>.<ext>, the label shown everywhere is derived from the stem
+    stem = re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_")
+    if not stem:
+        raise HTTPException(status_code=400, detail="Shopper name must contain letters or numbers")
+    return stem
+
+def _shopper_files(label: str) -> List[Path]:
+    if not SHOPPERS_DIR.exists():
+        return []
+    return [path for path in SHOPPERS_DIR.iterdir() if path.suffix.lower() in FACE_IMAGE_SUFFIXES and get_image_label(path.name) == label]
 
-    return {"shopper_category": str(current_shopper)}
+async def _embed_enrollment_image(img_bytes: bytes) -> np.ndarray:
+    try:
+        image = await asyncio.to_thread(decode_image, img_bytes)
+        embedding = (await inference_pool.run(represent_images, [image]))[0]
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InferenceQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Face inference is at capacity. Try again shortly.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER_SECONDS)},
+        )
+    except FaceWorkerError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if not embedding:
+        raise HTTPException(status_code=400, detail="No face detected in image")
+    return np.array(embedding[0]["embedding"])
+
+def _write_shopper(stem: str, suffix: str, img_bytes: bytes, embedding: np.ndarray, replaced: List[Path]) -> EmbeddingEntry:
+    """Save the image + its embedding (other images of the shopper are removed), run on a thread."""
+    SHOPPERS_DIR.mkdir(parents=True, exist_ok=True)
+    path = SHOPPERS_DIR / f"{stem}{suffix}"
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_bytes(img_bytes)
+    os.replace(tmp_path, path)
+    stale = [old for old in replaced if old.name != path.name]
+    for old in stale:
+        old.unlink(missing_ok=True)
+    stat = path.stat()
+    entry = EmbeddingEntry(path.name, get_image_label(path.name), hashlib.sha1(img_bytes).hexdigest(), stat.st_size, stat.st_mtime_ns)
+    embedding_store.update(upserts=[(entry, embedding)], remove_filenames=[old.name for old in stale])
+    return entry
+
+async def _enroll_shopper(name: str, file: UploadFile, replace: bool) -> dict:
+    stem = _shopper_stem(name)
+    label = get_image_label(stem)
+    suffix = Path(file.filename or "").suffix.lower()
+    if suffix not in FACE_IMAGE_SUFFIXES:
+        suffix = ".jpg"
+    img_bytes = await file.read()
+    # embed before taking the lock, only the cheap index/file updates are serialized
+    embedding = await _embed_enrollment_image(img_bytes)
+
+    async with _gallery_lock:
+        existing = _shopper_files(label)
+        if existing and not replace:
+            raise HTTPException(status_code=409, detail=f"{label} is already enrolled, use PUT to replace it")
+        entry = await asyncio.to_thread(_write_shopper, stem, suffix, img_bytes, embedding, existing)
+        # copy on write - concurrent compare-face calls keep searching the previous gallery
+        entries = {filename: other for filename, other in _gallery_entries.items() if other.label != label}
+        entries[entry.filename] = entry
+        # off the event loop, growing past FACE_ANN_MIN_SIZE trains the approximate index here
+        gallery = await asyncio.to_thread(face_gallery.copy_with, add=[(label, embedding)], remove={label})
+        _set_gallery(gallery, entries)
+    return {"status": "replaced" if existing else "enrolled", "shopper": label, "shoppers_indexed": len(face_gallery)}
+
+@router.post("/shoppers", dependencies=_requires_face)
+async def enroll_shopper(
+    request: Request,
+    name: str = Form(...),
+    file: UploadFile = File(...),
+    x_api_password: Optional[str] = Header(None)
+):
+    """Enroll a new shopper category from a face image, only the new image is embedded."""
+    await _authorize(request, x_api_password)
+    return await _enroll_shopper(name, file, replace=False)
+
+@router.put("/shoppers/{name}", dependencies=_requires_face)
+async def replace_shopper(
+    request: Request,
+    name: str,
+    file: UploadFile = File(...),
+    x_api_password: Optional[str] = Header(None)
+):
+    """Enroll or replace a shopper category's face image."""
+    await _authorize(request, x_api_password)
+    return await _enroll_shopper(name, file, replace=True)
+
+@router.delete("/shoppers/{name}", dependencies=_requires_face)
+async def delete_shopper(
+    request: Request,
+    name: str,
+    x_api_password: Optional[str] = Header(None)
+):
+    """Remove a shopper category from the gallery."""
+    await _authorize(request, x_api_password)
+    label = get_image_label(_shopper_stem(name))
+
+    async with _gallery_lock:
+        existing = _shopper_files(label)
+        if not existing and label not in face_gallery.labels:
+            raise HTTPException(status_code=404, detail=f"{label} is not enrolled")
+
+        def remove_files():
+            for path in existing:
+                path.unlink(missing_ok=True)
+            embedding_store.update(remove_filenames=[path.name for path in existing])
+
+        await asyncio.to_thread(remove_files)
+        _set_gallery(face_gallery.copy_with(remove={label}), {filename: entry for filename, entry in _gallery_entries.items() if entry.label != label})
+    return {"status": "deleted", "shopper": label, "shoppers_indexed": len(face_gallery)}
+
+
+def _shopper_response() -> dict:
+    return {"shopper_category": str(current_shopper.value), "version": current_shopper.version}
+
+@router.get("/current-shopper")
+async def list_current_shopper(since: Optional[int] = None, timeout: float = SHOPPER_WAIT_MAX_SECONDS):
+    """
+    List the current/active shopper category to be used in eink display.
+    Long poll by passing the last seen version as ?since=, the request is held until the
+    shopper changes (or timeout seconds pass, max 30) instead of returning the same value.
+    """
+    if since is not None:
+        await current_shopper.wait_for_change(since, min(max(timeout, 0), SHOPPER_WAIT_MAX_SECONDS))
+    return _shopper_response()
+
+
+@router.get("/current-shopper/stream")
+async def stream_current_shopper(request: Request, last_event_id: Optional[int] = Header(None)):
+    """Server sent events stream of current shopper changes (event id = version)."""
+    async def shopper_events():
+        sent_version = last_event_id
+        while not await request.is_disconnected():
+            if current_shopper.version != sent_version:
+                sent_version = current_shopper.version
+                yield f"id: {sent_version}\nevent: shopper\ndata: {json.dumps(_shopper_response())}\n\n"
+            elif not await current_shopper.wait_for_change(sent_version, SHOPPER_WAIT_MAX_SECONDS):
+                # comment line so proxies don't drop an idle connection
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        shopper_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/reset-shopper")
 async def reset_shopper():
     """Reset shopper"""
-    global current_shopper 
-    current_shopper = None
+    await current_shopper.set(None)
 
     return {"status": "success"}
 
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+# consecutive camera frames of someone standing still hash within a few bits of each other
+FACE_FRAME_CACHE_SIZE = int(os.environ.get("FACE_FRAME_CACHE_SIZE", "256"))
+FACE_FRAME_CACHE_TTL_SECONDS = float(os.environ.get("FACE_FRAME_CACHE_TTL_SECONDS", "10"))
+# max differing bits (of 64) for two frames to count as the same, 0 = exact hash matches only
+FACE_FRAME_CACHE_MAX_DISTANCE = int(os.environ.get("FACE_FRAME_CACHE_MAX_DISTANCE", "4"))
+DHASH_SIZE = 8
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def dhash(image: np.ndarray) -> np.uint64:
+    """64 bit difference hash of a bgr frame: is each pixel of a 9x8 grayscale thumbnail brighter than its right neighbour."""
+    # green carries most of the luminance, close enough for a hash and skips a full colour conversion
+    thumbnail = Image.fromarray(np.ascontiguousarray(image[:, :, 1])).resize((DHASH_SIZE + 1, DHASH_SIZE), Image.BOX)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return np.packbits(bits).view(">u8")[0].astype(np.uint64)
+
+
+@dataclass
+class CachedFrameResult:
+    embedding: np.ndarray
+    result: dict
+    top_k: int
+    expires_at: float
+
+
+class FrameResultCache:
+    """TTL + LRU cache of embeddings/match results keyed by a perceptual hash of the frame.
+
+    A lookup hits any live entry within max_distance bits of the frame's hash, so
+    near duplicate frames skip detection + embedding entirely. Hashes live in one
+    uint64 array so the nearest entry is found with a single vectorized xor/popcount.
+    """
+
+    def __init__(self, max_entries: int = FACE_FRAME_CACHE_SIZE, ttl_seconds: float = FACE_FRAME_CACHE_TTL_SECONDS, max_distance: int = FACE_FRAME_CACHE_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        # bumped by every clear(), a result computed against an older gallery isn't stored
+        self.generation = 0
+        self.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        """Drop everything, called whenever the gallery changes so stale matches are never served."""
+        with self._lock:
+            self.generation += 1
+            self._hashes = np.zeros(self.max_entries, dtype=np.uint64)
+            self._live = np.zeros(self.max_entries, dtype=bool)
+            self._entries = [None] * self.max_entries
+            # slot -> None, least recently used first
+            self._lru: "OrderedDict[int, None]" = OrderedDict()
+
+    def get(self, frame_hash: np.uint64) -> Optional[CachedFrameResult]:
+        if not self.max_entries:
+            return None
+        with self._lock:
+            distances = _popcount(self._hashes ^ frame_hash)
+            distances[~self._live] = 64 + 1
+            slot = int(np.argmin(distances))
+            entry = self._entries[slot]
+            if distances[slot] > self.max_distance or entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at < time.monotonic():
+                self._evict(slot)
+                self.misses += 1
+                return None
+            self._lru.move_to_end(slot)
+            self.hits += 1
+            return entry
+
+    def put(self, frame_hash: np.uint64, embedding: np.ndarray, result: dict, top_k: int, generation: Optional[int] = None) -> None:
+        """Store a result, skipped if the cache was cleared since generation was read (before the inference)."""
+        if not self.max_entries:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            # overwrite an entry for the same frame, else take a free slot, else evict the lru entry
+            same = np.flatnonzero(self._live & (self._hashes == frame_hash))
+            free = np.flatnonzero(~self._live)
+            if len(same):
+                slot = int(same[0])
+            elif len(free):
+                slot = int(free[0])
+            else:
+                slot = next(iter(self._lru))
+            self._hashes[slot] = frame_hash
+            self._live[slot] = True
+            self._entries[slot] = CachedFrameResult(embedding, result, top_k, time.monotonic() + self.ttl_seconds)
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def _evict(self, slot: int) -> None:
+        self._live[slot] = False
+        self._entries[slot] = None
+        self._lru.pop(slot, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": int(self._live.sum()),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+frame_cache = FrameResultCache()
@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_DIR = Path(os.environ.get("SEARCH_INDEX_DIR", "app/search_index"))
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def parse_query(query: str) -> tuple[list[str], list[list[str]]]:
+    """Split a query into all of its terms and the "quoted phrases" that must match in order."""
+    phrases = [tokenize(phrase) for phrase in _PHRASE_PATTERN.findall(query)]
+    phrases = [phrase for phrase in phrases if len(phrase) > 1]
+    return tokenize(query), phrases
+
+
+@dataclass
+class SearchHit:
+    kind: str
+    title: str
+    url: str
+    score: float
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "title": self.title, "url": self.url, "score": round(self.score, 4)}
+
+
+class FullTextIndex:
+    """
+    Read side of the inverted index written by build_search_index.py.
+
+    Postings are three flat uint32 arrays (doc ids, term frequencies and
+    positions) that are memory-mapped, so a term's postings are just slices
+    and BM25 scoring is vectorized over them. The lexicon maps a term to
+    [doc frequency, offset into doc ids/freqs, offset into positions].
+    """
+
+    def __init__(self, index_dir: Path = SEARCH_INDEX_DIR):
+        self.index_dir = index_dir
+        with open(index_dir / "lexicon.json", "r") as f:
+            self.lexicon: dict[str, list[int]] = json.loads(f.read())
+        with open(index_dir / "docs.json", "r") as f:
+            self.docs: list[dict] = json.loads(f.read())
+
+        self.doc_ids = np.load(index_dir / "doc_ids.npy", mmap_mode="r")
+        self.freqs = np.load(index_dir / "freqs.npy", mmap_mode="r")
+        self.positions = np.load(index_dir / "positions.npy", mmap_mode="r")
+        self.doc_lengths = np.load(index_dir / "doc_lengths.npy", mmap_mode="r")
+        self.doc_kinds = np.array([doc["kind"] for doc in self.docs])
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _postings(self, term: str) -> tuple[np.ndarray, np.ndarray, int]:
+        doc_freq, doc_offset, positions_offset = self.lexicon[term]
+        return (
+            self.doc_ids[doc_offset:doc_offset + doc_freq],
+            self.freqs[doc_offset:doc_offset + doc_freq],
+            positions_offset,
+        )
+
+    def _phrase_starts(self, phrase: list[str], doc_ids: np.ndarray) -> list[np.ndarray]:
+        """For each phrase term, the offset of its positions in every one of doc_ids (which must all contain it)."""
+        term_starts = []
+        for term in phrase:
+            term_doc_ids, freqs, positions_offset = self._postings(term)
+            freqs = np.asarray(freqs, dtype=np.int64)
+            # exclusive cumsum gives where each doc's positions start for this term
+            offsets = positions_offset + np.concatenate([[0], np.cumsum(freqs)[:-1]])
+            idx = np.searchsorted(term_doc_ids, doc_ids)
+            term_starts.append(np.stack([offsets[idx], freqs[idx]], axis=1))
+        return term_starts
+
+    def _has_phrase(self, term_starts: list[np.ndarray], doc_idx: int) -> bool:
+        # positions where the phrase could start, narrowed term by term
+        start, freq = term_starts[0][doc_idx]
+        starts = np.asarray(self.positions[start:start + freq])
+        for offset, term_start in enumerate(term_starts[1:], start=1):
+            start, freq = term_start[doc_idx]
+            starts = np.intersect1d(starts, np.asarray(self.positions[start:start + freq]).astype(np.int64) - offset)
+            if len(starts) == 0:
+                return False
+        return True
+
+    def search(self, query: str, limit: int = 10, kind: Optional[str] = None) -> list[SearchHit]:
+        terms, phrases = parse_query(query)
+        terms = [term for term in dict.fromkeys(terms) if term in self.lexicon]
+        if not terms or any(term not in self.lexicon for phrase in phrases for term in phrase):
+            return []
+
+        n_docs = len(self.docs)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in terms:
+            doc_ids, freqs, _ = self._postings(term)
+            idf = np.log(1.0 + (n_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            tf = freqs.astype(np.float32)
+            length_norm = 1.0 - BM25_B + BM25_B * self.doc_lengths[doc_ids] / self.avg_doc_length
+            scores[doc_ids] += idf * tf * (BM25_K1 + 1.0) / (tf + BM25_K1 * length_norm)
+
+        candidates = np.flatnonzero(scores)
+        if phrases:
+            # phrase matches need every phrase term in the doc, then an in-order position check
+            for phrase in phrases:
+                for term in phrase:
+                    candidates = np.intersect1d(candidates, self._postings(term)[0])
+            phrase_starts = [self._phrase_starts(phrase, candidates) for phrase in phrases]
+            candidates = np.array([
+                doc_id for doc_idx, doc_id in enumerate(candidates)
+                if all(self._has_phrase(term_starts, doc_idx) for term_starts in phrase_starts)
+            ], dtype=np.int64)
+        if kind is not None:
+            candidates = candidates[self.doc_kinds[candidates] == kind]
+        if len(candidates) == 0:
+            return []
+
+        if len(candidates) > limit:
+            top = np.argpartition(scores[candidates], -limit)[-limit:]
+            candidates = candidates[top]
+        ranked = sorted(candidates, key=lambda doc_id: scores[doc_id], reverse=True)
+        return [
+            SearchHit(kind=self.docs[doc_id]["kind"], title=self.docs[doc_id]["title"], url=self.docs[doc_id]["url"], score=float(scores[doc_id]))
+            for doc_id in ranked
+        ]
+
+
+_full_text_index: Optional[FullTextIndex] = None
+
+def load_full_text_index(index_dir: Path = SEARCH_INDEX_DIR) -> Optional[FullTextIndex]:
+    """(Re)load the index, leaves full text search off if it hasn't been built."""
+    global _full_text_index
+    if not (index_dir / "lexicon.json").exists():
+        _logger.info(f"No full text search index in {index_dir}, run `python -m app.build_search_index`")
+        _full_text_index = None
+        return None
+    _full_text_index = FullTextIndex(index_dir)
+    _logger.info(f"Loaded full text search index with {len(_full_text_index)} documents")
+    return _full_text_index
+
+def get_full_text_index() -> Optional[FullTextIndex]:
+    return _full_text_index
@@ -1,7 +1,8 @@
 from pathlib import Path
 import xml.etree.ElementTree as ET
 from datetime import datetime
-from wiki import clean_topic_name, get_topics
+from app.wiki import clean_topic_name, get_topics
+from app.blogs import blog_index
 
 custom_md_pages = {
     "videos": Path(f"app/static/content/videos/my-videos.md"),
@@ -17,11 +18,9 @@ custom_md_pages = {
 def get_blog_urls():
     # blogs path - 
     # root/blog/{page_name}
-    blog_dir = Path("app/static/content/blogs")
-    blog_files = [f for f in blog_dir.glob("*.md") if f.is_file() and f.name != "summary.md"]
     urls = []
-    for blog_file in blog_files:
-        page_name = blog_file.stem
+    for post in blog_index.posts:
+        page_name = post.slug
         # clearn urls (to match frontend routing)
         page_name = page_name.lower().replace("'", "").replace(" ", "-")
         url = f"https://prestonblackburn.com/blog/{page_name}"
@@ -1,14 +1,34 @@
 from fastapi import FastAPI, Depends, HTTPException, Response, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from app import wiki
-from app import facial_recognition
+from app import http_cache
+from app.face_backend import FACE_MODE
+from app.markdown_cache import markdown_cache
+from app.blogs import blog_index
+from app.full_text_search import get_full_text_index
+from app.content_pack import load_content_pack
+from app.metrics import MetricsMiddleware, render_metrics, register_cache, instrument_templates
+from app.build_site import load_prerendered_site, PrerenderedPagesMiddleware
+from app.content_watcher import ContentWatcher, CONTENT_WATCH
+from app.compression import PrecompressedStaticFiles
+from app.http_cache import (
+    conditional_response,
+    file_response_version,
+    make_etag,
+    mtime_to_datetime,
+    page_cache,
+    PAGE_CACHE_CONTROL,
+    FEED_CACHE_CONTROL,
+    API_CACHE_CONTROL,
+)
 
-import markdown
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
+import asyncio
 import logging
 import os
 from datetime import datetime
@@ -22,7 +42,29 @@ logging.getLogger("uvicorn.access").setLevel(logging.INFO)
 
 _logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the blog index up front instead of on the first request
+    blog_index.scan()
+    # rendered markdown + wiki topics shared (memory-mapped) by every worker, when built
+    load_content_pack()
+    watcher_task = ContentWatcher().start() if CONTENT_WATCH else None
+    yield
+    if watcher_task is not None:
+        watcher_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await watcher_task
+
+app = FastAPI(lifespan=lifespan)
+
+# serve pages from `python -m app.build_site` when available, anything
+# not in the build falls through to the dynamic routes below
+SERVE_PRERENDERED = os.environ.get("SERVE_PRERENDERED", "false").lower() in ("1", "true")
+prerendered_pages = load_prerendered_site() if SERVE_PRERENDERED else {}
+
+if prerendered_pages:
+    # added before CORSMiddleware so it sits inside it and prerendered pages get the same CORS headers
+    app.add_middleware(PrerenderedPagesMiddleware, pages=prerendered_pages)
 
 # TODO - add restrictions when in prod
 app.add_middleware(
@@ -36,14 +78,25 @@ app.add_middleware(
 )
 
 templates = Jinja2Templates(directory="app/templates")
+instrument_templates(templates)
 
 # static files (nees to be called before the router for pathing)
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+app.mount("/static", PrecompressedStaticFiles(directory="app/static"), name="static")
 # Serve robots.txt and sitemap.xml
-app.mount("/metadata", StaticFiles(directory="app/static/metadata"), name="metadata")
+app.mount("/metadata", PrecompressedStaticFiles(directory="app/static/metadata"), name="metadata")
 
 app.include_router(wiki.router)
-app.include_router(facial_recognition.router)
+if FACE_MODE != "disabled":
+    # imported here so blog/wiki only workers never load the face stack
+    from app import facial_recognition
+    app.include_router(facial_recognition.router)
+
+# added last so it is the outermost middleware and times everything above, prerendered pages included
+app.add_middleware(MetricsMiddleware)
+register_cache("page", page_cache.stats)
+# a page served from the content pack didn't need rendering either
+register_cache("markdown", lambda: {**markdown_cache.stats(), "hits": markdown_cache.hits + markdown_cache.pack_hits})
+register_cache("wiki_topic", wiki.wiki_store.cache_stats)
 
 def get_home_page(
     request: Request, 
@@ -61,16 +114,30 @@ def get_home_page(
 async def home(
     request: Request
 ) -> HTMLResponse:
-    response = get_home_page(request, templates)
+    etag = make_etag("home", http_cache.TEMPLATES_VERSION)
+    response = conditional_response(request, etag, lambda: get_home_page(request, templates))
     return response
 
+def serve_metadata_file(request: Request, path: Path, media_type: str = None):
+    try:
+        etag, last_modified = file_response_version(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not found")
+    return conditional_response(
+        request,
+        etag,
+        lambda: FileResponse(path, media_type=media_type),
+        cache_control=FEED_CACHE_CONTROL,
+        last_modified=last_modified,
+    )
+
 @app.get("/robots.txt")
-async def robots():
-    return FileResponse("app/static/metadata/robots.txt")
+async def robots(request: Request):
+    return serve_metadata_file(request, Path("app/static/metadata/robots.txt"))
 
 @app.get("/sitemap.xml")
-async def sitemap():
-    return FileResponse("app/static/metadata/sitemap.xml")
+async def sitemap(request: Request):
+    return serve_metadata_file(request, Path("app/static/metadata/sitemap.xml"), media_type="application/xml")
 
 
 # For generic pages (just md serving)
@@ -84,23 +151,29 @@ custom_md_pages = {
     # "blogs": Path(f"app/static/content/blogs/summary.md"),
 }
 
+def get_generic_page_context(content_path:Path) -> dict:
+    # raises FileNotFoundError if the page content is missing
+    html = markdown_cache.render(content_path)
+    return {"content": html, "landing_page": False}
+
 def generic_markdown_page_generator(content_path:Path):
     def serve_markdown_page(
         request: Request,
     )-> HTMLResponse:
         
-        if not content_path.exists():
+        try:
+            content_version = markdown_cache.version(content_path)
+        except FileNotFoundError:
             # can setup better 404 later
             return HTMLResponse("<h1>404 Not Found</h1>", status_code=404)
-        
-        md_text = content_path.read_text(encoding="utf-8")
-        html = markdown.markdown(md_text, extensions=['fenced_code', 'codehilite'])
 
-        context = {"request": request, "content": html, "landing_page": False}
-        response = templates.TemplateResponse("pages/generic_md_page.html", context)
-        print(response)
+        def render_page():
+            context = {"request": request, **get_generic_page_context(content_path)}
+            response = templates.TemplateResponse("pages/generic_md_page.html", context)
+            return response
 
-        return response
+        etag = make_etag("page", content_path, content_version, http_cache.TEMPLATES_VERSION)
+        return conditional_response(request, etag, render_page, last_modified=mtime_to_datetime(content_version[0]))
     return serve_markdown_page
 
 for page_route, content_path in custom_md_pages.items():
@@ -109,57 +182,56 @@ for page_route, content_path in custom_md_pages.items():
 
 
 
-def get_blog_metadata(blog_dir:Path = Path("app/static/content/blogs")):
-    blog_files = [f for f in blog_dir.glob("*.md") if f.is_file() and f.name != "summary.md"]
-    metadata = []
-    for blog_file in blog_files:
-        # Simple metadata extraction from filename, can be extended to read front-matter if needed
-        blog_data = {}
-        with open(blog_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            title = lines[0].strip()
-            date = None
-            for line in lines[1:]:
-                if "," in line and line[0].isalpha():
-                    date = line.strip()
-                    break
-            thumbnail = None
-            for line in lines:
-                if line.startswith("![") and "(" in line and ")" in line:
-                    thumbnail = line.split("(", 1)[1].rsplit(")", 1)[0].strip()
-                    break
-
-            blog_data.update({"title": title, "date": date, "thumbnail_image": thumbnail, "slug": blog_file.stem})
-        metadata.append(blog_data)
-
-        # sort metadta by date (newest first)
-        metadata = sorted(metadata, key=lambda x: datetime.strptime(x['date'], "%b %d, %Y"), reverse=True)
-    return metadata  
+def get_blog_metadata():
+    return blog_index.metadata()
 
 def get_blogs_rss_feed() -> list[dict]:
     # fields: title, link, description, pub_date 
-    blog_metadata = get_blog_metadata()
-
     rss_data = []
-    for blog_data in blog_metadata:
-        date = datetime.strptime(blog_data['date'], "%b %d, %Y")
-        rss_data.append({"pub_date": date, "link": f"https://prestonblackburn.com/blog/{blog_data['slug']}", "title": blog_data['title'], "description": blog_data['title']})
+    for post in blog_index.posts:
+        rss_data.append({"pub_date": post.published, "link": f"https://prestonblackburn.com/blog/{post.slug}", "title": post.title, "description": post.title})
 
     return rss_data
 
+def get_blogs_landing_context() -> dict:
+    return {"blogs_metadata": get_blog_metadata()}
+
+def get_blog_path(page_name:str) -> Path:
+    return Path(f"app/static/content/blogs/{page_name}.md")
+
+def get_blog_page_context(page_name:str) -> dict:
+    # raises FileNotFoundError if there is no post with this name
+    html = markdown_cache.render(get_blog_path(page_name))
+    return {"content": html}
+
+def get_blog_index_validators() -> tuple[str, datetime]:
+    # etag + last modified for everything derived from the blog index (listing, rss, apis)
+    version, last_modified_ns = blog_index.validators()
+    return version, mtime_to_datetime(last_modified_ns)
+
+def get_rss_context() -> dict:
+    return {
+        "posts": get_blogs_rss_feed(),
+        "site_title": "My Blog",
+        "site_link": "https://example.com",
+        "site_description": "My blog description",
+        "build_date": datetime.now()
+    }
+
 
 @app.get("/blogs", response_class=HTMLResponse)
 async def serve_blogs_landing(
     request: Request
 )-> HTMLResponse:
     
-    blog_metadata = get_blog_metadata()
-
-    context = {"request": request, "blogs_metadata": blog_metadata}
-    response = templates.TemplateResponse("pages/blogs.html", context)
-    print(response)
+    def render_page():
+        context = {"request": request, **get_blogs_landing_context()}
+        response = templates.TemplateResponse("pages/blogs.html", context)
+        return response
 
-    return response
+    blogs_version, last_modified = get_blog_index_validators()
+    etag = make_etag("blogs", blogs_version, http_cache.TEMPLATES_VERSION)
+    return conditional_response(request, etag, render_page, last_modified=last_modified)
 
 @app.get("/blog/{page_name}", response_class=HTMLResponse)
 async def serve_markdown_page(
@@ -167,20 +239,20 @@ async def serve_markdown_page(
     request: Request
 )-> HTMLResponse:
     
-    md_file = Path(f"app/static/content/blogs/{page_name}.md")
-    print(f'looking in {os.listdir(Path("app/static/content"))}')
-    if not md_file.exists():
+    md_file = get_blog_path(page_name)
+    try:
+        content_version = markdown_cache.version(md_file)
+    except FileNotFoundError:
         # can setup better 404 later
         return HTMLResponse("<h1>404 Not Found</h1>", status_code=404)
-    
-    md_text = md_file.read_text(encoding="utf-8")
-    html = markdown.markdown(md_text, extensions=['fenced_code', 'codehilite'])
 
-    context = {"request": request, "content": html}
-    response = templates.TemplateResponse("pages/blog.html", context)
-    print(response)
+    def render_page():
+        context = {"request": request, **get_blog_page_context(page_name)}
+        response = templates.TemplateResponse("pages/blog.html", context)
+        return response
 
-    return response
+    etag = make_etag("blog", md_file, content_version, http_cache.TEMPLATES_VERSION)
+    return conditional_response(request, etag, render_page, last_modified=mtime_to_datetime(content_version[0]))
 
 
 @app.get("/api/v1/pages")
@@ -188,47 +260,53 @@ async def list_pages():
     return {"pages": list(custom_md_pages.keys())}
 
 @app.get("/api/v1/blogs")
-async def list_blogs():
-    blog_dir = Path("app/static/content/blogs")
-    blog_files = [f for f in blog_dir.glob("*.md") if f.is_file() and f.name != "summary.md"]
-    metadata = []
-    for blog_file in blog_files:
-        # Simple metadata extraction from filename, can be extended to read front-matter if needed
-        blog_data = {}
-        with open(blog_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            title = lines[0].strip()
-            date = None
-            for line in lines[1:]:
-                if "," in line and line[0].isalpha():
-                    date = line.strip()
-                    break
-            blog_data.update({"title": title, "date": date})
-        metadata.append(blog_data)
-    ordered_blogs = sorted(metadata, key=lambda blog_info: datetime.strptime(blog_info['date'], "%b %d, %Y"), reverse=True)
-    ordered_blogs_list = [blog['title'] for blog in ordered_blogs]
-
-    return {"blogs": ordered_blogs_list}
+async def list_blogs(request: Request):
+    blogs_version, last_modified = get_blog_index_validators()
+    return conditional_response(
+        request,
+        make_etag("api-blogs", blogs_version),
+        lambda: JSONResponse({"blogs": blog_index.titles()}),
+        cache_control=API_CACHE_CONTROL,
+        last_modified=last_modified,
+    )
 
 @app.get("/api/v1/blogs/metadata")
-async def blogs_metadata():
-    metadata = get_blog_metadata()
-    return {"blogs": metadata}
+async def blogs_metadata(request: Request):
+    blogs_version, last_modified = get_blog_index_validators()
+    return conditional_response(
+        request,
+        make_etag("api-blogs-metadata", blogs_version),
+        lambda: JSONResponse({"blogs": get_blog_metadata()}),
+        cache_control=API_CACHE_CONTROL,
+        last_modified=last_modified,
+    )
+
+@app.get("/api/v1/search")
+async def full_text_search(q: str, limit: int = 10, kind: str = None):
+    # kind filters to "wiki" or "blog" results
+    full_text_index = get_full_text_index()
+    if full_text_index is None:
+        raise HTTPException(status_code=503, detail="Search index has not been built")
+    hits = full_text_index.search(q, limit=min(max(limit, 1), 50), kind=kind)
+    return {"query": q, "results": [hit.to_dict() for hit in hits]}
 
 @app.get("/rss")
 async def get_rss(request: Request):
-    blog_metadata = get_blogs_rss_feed()
-    rss_content = templates.get_template("rss.xml").render({
-        "request": request,
-        "posts": blog_metadata,
-        "site_title": "My Blog",
-        "site_link": "https://example.com",
-        "site_description": "My blog description",
-        "build_date": datetime.now()
-    })
-    
-    return Response(content=rss_content, media_type="application/rss+xml")
+    def render_feed():
+        rss_content = templates.get_template("rss.xml").render({
+            "request": request,
+            **get_rss_context()
+        })
+        return Response(content=rss_content, media_type="application/rss+xml")
+
+    blogs_version, last_modified = get_blog_index_validators()
+    etag = make_etag("rss", blogs_version, http_cache.TEMPLATES_VERSION)
+    return conditional_response(request, etag, render_feed, cache_control=FEED_CACHE_CONTROL, last_modified=last_modified)
+
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/healthz")
 async def health_check():
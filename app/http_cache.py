@@ -0,0 +1,222 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Optional
+import hashlib
+import os
+import threading
+
+from fastapi import Request, Response
+
+from app.compression import compress_body, get_accepted_encoding, is_compressible
+
+# per route Cache-Control policies
+PAGE_CACHE_CONTROL = "public, max-age=300, stale-while-revalidate=3600"
+FEED_CACHE_CONTROL = "public, max-age=900"
+API_CACHE_CONTROL = "public, max-age=60"
+
+TEMPLATE_DIR = Path("app/templates")
+# dynamic responses smaller than this aren't worth compressing
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def make_etag(*version_parts) -> str:
+    """Strong ETag from the versions of whatever a response was rendered from."""
+    digest = hashlib.sha1("|".join(str(part) for part in version_parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:24]}"'
+
+
+def get_templates_version(template_dir: Path = TEMPLATE_DIR) -> str:
+    # every rendered page depends on the templates too
+    mtimes = sorted((str(path), path.stat().st_mtime_ns) for path in template_dir.rglob("*.html"))
+    return make_etag(*mtimes).strip('"')
+
+
+# read as http_cache.TEMPLATES_VERSION (not imported by value), the content watcher refreshes it
+TEMPLATES_VERSION = get_templates_version()
+
+
+def refresh_templates_version() -> None:
+    """Recompute TEMPLATES_VERSION after a template changed on disk."""
+    global TEMPLATES_VERSION
+    TEMPLATES_VERSION = get_templates_version()
+
+
+def mtime_to_datetime(mtime_ns: int) -> datetime:
+    return datetime.fromtimestamp(mtime_ns / 1e9, tz=timezone.utc)
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    # each content-encoding is its own representation, so it gets its own strong etag
+    if encoding is None:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _strip_etag(etag: str) -> str:
+    # If-None-Match uses the weak comparison, so ignore W/ prefixes (and our encoding suffix)
+    etag = etag.strip().removeprefix("W/")
+    for suffix in ('-br"', '-gzip"'):
+        if etag.endswith(suffix):
+            return etag.removesuffix(suffix) + '"'
+    return etag
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [_strip_etag(candidate) for candidate in if_none_match.split(",")]
+    return _strip_etag(etag) in candidates
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # http dates only have second resolution
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+@dataclass
+class CachedBody:
+    body: bytes
+    media_type: str
+    content_encoding: Optional[str]
+
+
+class RenderedPageCache:
+    """
+    Byte-bounded LRU of rendered response bodies keyed on (etag, encoding).
+    Because etags come from source versions, a hit skips the render and the
+    compression entirely, and an edit to the source just stops being hit.
+    """
+
+    def __init__(self, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[CachedBody]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def peek(self, key: tuple) -> Optional[CachedBody]:
+        """get() without counting a hit/miss, for follow up lookups within a request that already missed."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, entry: CachedBody):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= len(previous.body)
+            self._entries[key] = entry
+            self.size_bytes += len(entry.body)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+page_cache = RenderedPageCache()
+
+
+def _cached_response(entry: CachedBody, headers: dict) -> Response:
+    if entry.content_encoding is not None:
+        headers = {**headers, "Content-Encoding": entry.content_encoding, "ETag": encoded_etag(headers["ETag"], entry.content_encoding)}
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+
+
+def _render_and_cache(render: Callable[[], Response], etag: str, encoding: Optional[str], headers: dict) -> Response:
+    # compress an already rendered body if there is one, so every encoding of an etag has the same content
+    # (the request already counted its miss in conditional_response)
+    identity = page_cache.peek((etag, None)) if encoding is not None else None
+    if identity is None:
+        response = render()
+        # file/streaming responses and errors pass straight through
+        if response.status_code != 200 or not hasattr(response, "body"):
+            response.headers.update(headers)
+            return response
+        identity = CachedBody(body=response.body, media_type=response.media_type, content_encoding=None)
+        page_cache.put((etag, None), identity)
+
+    if encoding is None or len(identity.body) < COMPRESSION_MIN_BYTES or not is_compressible(identity.media_type):
+        # same (uncompressed) body for every encoding, so only cache it once
+        if encoding is not None:
+            page_cache.put((etag, encoding), identity)
+        return _cached_response(identity, headers)
+
+    compressed = CachedBody(body=compress_body(identity.body, encoding), media_type=identity.media_type, content_encoding=encoding)
+    page_cache.put((etag, encoding), compressed)
+    return _cached_response(compressed, headers)
+
+
+def conditional_response(
+    request: Request,
+    etag: str,
+    render: Callable[[], Response],
+    cache_control: str = PAGE_CACHE_CONTROL,
+    last_modified: Optional[datetime] = None,
+) -> Response:
+    """
+    Answer with a 304 when the client already has this version, then with a
+    cached (and compressed, if accepted) body for this version, and only
+    otherwise call render(). Only the version is hashed, never the body.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if request.method in ("GET", "HEAD") and is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    encoding = get_accepted_encoding(request.headers.get("accept-encoding", ""))
+    cached = page_cache.get((etag, encoding))
+    if cached is not None:
+        return _cached_response(cached, headers)
+    return _render_and_cache(render, etag, encoding, headers)
+
+
+def file_response_version(path: Path) -> tuple[str, datetime]:
+    stat = path.stat()
+    return make_etag(path, stat.st_mtime_ns, stat.st_size), mtime_to_datetime(stat.st_mtime_ns)
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+import threading
+import logging
+
+import markdown
+
+from app.content_pack import get_content_pack
+from app.metrics import timed
+
+_logger = logging.getLogger(__name__)
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'codehilite']
+
+
+def render_markdown(md_text: str) -> str:
+    with timed("markdown_render"):
+        return markdown.markdown(md_text, extensions=MARKDOWN_EXTENSIONS)
+
+
+class RenderedMarkdownCache:
+    """
+    Bounded LRU of rendered markdown html, keyed on the source path.
+    Each entry remembers the (mtime, size) it was rendered from, so an edited
+    file is re-rendered on the next request and everything else is served as is.
+    Files whose html is in the content pack are served from the shared mapping
+    and never rendered or cached per worker (unless they've changed since),
+    only their version is kept so they aren't stat'ed on every request either.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        # turned off while the content watcher is running, it refreshes
+        # entries itself so requests don't need to stat the source file
+        self.validate_mtime = True
+        self.hits = 0
+        self.pack_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        # the generic page routes are sync and run in the threadpool
+        self._lock = threading.Lock()
+
+    def render(self, path: Path) -> str:
+        """Return the html for a markdown file. Raises FileNotFoundError if it doesn't exist."""
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and not self.validate_mtime:
+            version = entry[0]
+        else:
+            version = self._get_version(path)
+
+        if entry is not None and entry[0] == version:
+            # html None marks a page served from the content pack
+            html = entry[1] if entry[1] is not None else self._read_packed(path, version)
+            if html is not None:
+                with self._lock:
+                    self._entries.move_to_end(path)
+                    if entry[1] is None:
+                        self.pack_hits += 1
+                    else:
+                        self.hits += 1
+                return html
+
+        html = self._read_packed(path, version)
+        if html is not None:
+            # only the version is kept, so later requests skip the stat but still read the shared mapping
+            self._store(path, version, None)
+            with self._lock:
+                self.pack_hits += 1
+            return html
+        with self._lock:
+            self.misses += 1
+        return self._render_and_store(path, version)
+
+    def version(self, path: Path) -> tuple:
+        """(mtime_ns, size) of the source file. Raises FileNotFoundError if it doesn't exist."""
+        if not self.validate_mtime:
+            entry = self._entries.get(path)
+            if entry is not None:
+                return entry[0]
+        return self._get_version(path)
+
+    def _get_version(self, path: Path) -> tuple:
+        stat = path.stat()
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read_packed(self, path: Path, version: tuple) -> Optional[str]:
+        content_pack = get_content_pack()
+        if content_pack is None:
+            return None
+        return content_pack.get_text(f"md/{path.as_posix()}", version)
+
+    def _render_and_store(self, path: Path, version: tuple) -> str:
+        # render outside the lock, codehilite on long posts takes a while
+        html = render_markdown(path.read_text(encoding="utf-8"))
+        self._store(path, version, html)
+        return html
+
+    def _store(self, path: Path, version: tuple, html: Optional[str]):
+        with self._lock:
+            self._entries[path] = (version, html)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                evicted_path, _ = self._entries.popitem(last=False)
+                _logger.debug(f"Evicted rendered markdown: {evicted_path}")
+
+    def invalidate(self, path: Path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def refresh(self, path: Path):
+        """Re-render a changed file and swap it in (readers keep getting the old html until then)."""
+        try:
+            self._render_and_store(path, self._get_version(path))
+        except FileNotFoundError:
+            self.invalidate(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "pack_hits": self.pack_hits,
+            "misses": self.misses,
+        }
+
+
+markdown_cache = RenderedMarkdownCache()
@@ -0,0 +1,229 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+import logging
+import threading
+import time
+
+from jinja2 import Template
+from starlette.routing import Match
+
+_logger = logging.getLogger(__name__)
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# requests are labelled with their route template (ex /wiki/{topic}), resolved once per path
+ROUTE_LABEL_CACHE_SIZE = 4096
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = list(self._values.items())
+        lines += [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values]
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    """Prometheus style histogram: per label set a count per bucket (non cumulative until rendered), sum and count."""
+
+    def __init__(self, name: str, help: str, labelnames: Labels = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts (+ one for +Inf), sum]
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bucket] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        names = (*self.labelnames, "le")
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, (*labels, _format_value(bound)))} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+http_requests = Counter("http_requests_total", "Requests handled, by route and status.", ("method", "route", "status"))
+http_request_duration = Histogram("http_request_duration_seconds", "Request latency until the response is fully sent.", ("method", "route"))
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled.", ("route",))
+http_response_size = Histogram("http_response_size_bytes", "Response body size (after compression).", ("route",), buckets=SIZE_BUCKETS)
+phase_duration = Histogram("app_phase_duration_seconds", "Time spent in a phase inside a request (json_load, markdown_render, jinja_render, face_inference, similarity_search).", ("phase",))
+
+METRICS = [http_requests, http_request_duration, http_requests_in_flight, http_response_size, phase_duration]
+
+# name -> stats() callable returning hits/misses (+ entries) for a cache, read at scrape time
+_cache_collectors: Dict[str, Callable[[], dict]] = {}
+
+
+def register_cache(name: str, stats: Callable[[], dict]) -> None:
+    _cache_collectors[name] = stats
+
+
+@contextmanager
+def timed(phase: str):
+    """Record how long the block takes under app_phase_duration_seconds{phase=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_duration.observe(time.perf_counter() - start, phase)
+
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs) -> str:
+        with timed("jinja_render"):
+            return super().render(*args, **kwargs)
+
+
+def instrument_templates(templates) -> None:
+    """Time every top level template render (TemplateResponse or get_template().render) of a Jinja2Templates."""
+    templates.env.template_class = TimedTemplate
+
+
+def _render_cache_metrics() -> List[str]:
+    series = {
+        "app_cache_hits_total": ("counter", "Cache hits."),
+        "app_cache_misses_total": ("counter", "Cache misses."),
+        "app_cache_hit_ratio": ("gauge", "Hits / lookups since the worker started."),
+        "app_cache_entries": ("gauge", "Entries currently cached."),
+    }
+    samples = {name: [] for name in series}
+    for cache, stats in list(_cache_collectors.items()):
+        try:
+            values = stats()
+        except Exception:
+            _logger.exception(f"Could not collect stats for the {cache} cache")
+            continue
+        labels = _format_labels(("cache",), (cache,))
+        hits, misses = values.get("hits", 0), values.get("misses", 0)
+        samples["app_cache_hits_total"].append(f"app_cache_hits_total{labels} {hits}")
+        samples["app_cache_misses_total"].append(f"app_cache_misses_total{labels} {misses}")
+        if hits + misses:
+            samples["app_cache_hit_ratio"].append(f"app_cache_hit_ratio{labels} {hits / (hits + misses)!r}")
+        if values.get("entries") is not None:
+            samples["app_cache_entries"].append(f"app_cache_entries{labels} {values['entries']}")
+    lines = []
+    for name, (kind, help) in series.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", *samples[name]]
+    return lines
+
+
+def render_metrics() -> str:
+    """Everything in the Prometheus text exposition format. Values are per worker process."""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _render_cache_metrics()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task/stream overhead) recording
+    per route latency, in flight requests, response sizes and status counts.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_labels: Dict[Tuple[str, str], str] = {}
+
+    def _route_label(self, scope) -> str:
+        key = (scope["type"], scope["path"])
+        label = self._route_labels.get(key)
+        if label is None:
+            label = "unmatched"
+            # the fastapi app is the innermost app of the middleware stack
+            for route in scope["app"].router.routes:
+                match, _ = route.matches(scope)
+                if match != Match.NONE:
+                    label = getattr(route, "path", None) or "unmatched"
+                    break
+            if len(self._route_labels) >= ROUTE_LABEL_CACHE_SIZE:
+                self._route_labels.clear()
+            self._route_labels[key] = label
+        return label
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        route = self._route_label(scope)
+        method = scope["method"]
+        status = 500
+        size = 0
+
+        async def send_and_record(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        http_requests_in_flight.inc(route)
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            http_requests_in_flight.dec(route)
+            http_request_duration.observe(time.perf_counter() - start, method, route)
+            http_response_size.observe(size, route)
+            http_requests.inc(method, route, str(status))
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# "memory" limits per worker, "sqlite" shares the counters between every worker on the host
+RATE_LIMIT_BACKEND = os.environ.get("FACE_RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_DB = os.environ.get("FACE_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "face_rate_limit.sqlite3"))
+# hard cap on tracked clients for the memory backend, least recently seen are dropped first
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("FACE_RATE_LIMIT_MAX_KEYS", "100000"))
+# the sqlite backend sweeps idle clients every this many checks
+SQLITE_EVICT_EVERY = 1000
+
+# (window index, count in that window, count in the window before it)
+WindowState = Tuple[int, int, int]
+
+
+def sliding_window_check(state: Optional[WindowState], now: float, limit: int, window: float) -> Tuple[bool, WindowState]:
+    """Sliding window counter: O(1) state per client instead of a timestamp per request.
+
+    The previous fixed window's count is weighted by how much of it still overlaps the
+    sliding window, which approximates the exact sliding log closely for steady traffic.
+    """
+    window_index = int(now // window)
+    if state is None or state[0] < window_index - 1:
+        current, previous = 0, 0
+    elif state[0] == window_index - 1:
+        current, previous = 0, state[1]
+    else:
+        current, previous = state[1], state[2]
+
+    elapsed = (now % window) / window
+    if previous * (1 - elapsed) + current >= limit:
+        return False, (window_index, current, previous)
+    return True, (window_index, current + 1, previous)
+
+
+class MemoryRateLimiter:
+    """Per worker limiter, clients idle for two windows (their count can no longer matter) are evicted."""
+
+    # allow() never waits on anything but an in process lock, cheap enough to call on the event loop
+    blocking = False
+
+    def __init__(self, limit: int, window: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> (window state, last seen), least recently seen first
+        self._clients: "OrderedDict[str, Tuple[WindowState, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def _evict(self, now: float) -> None:
+        # oldest first, so this stops at the first client still active (amortized O(1))
+        while self._clients:
+            key, (_, last_seen) = next(iter(self._clients.items()))
+            if last_seen >= now - 2 * self.window and len(self._clients) <= self.max_keys:
+                break
+            self._clients.popitem(last=False)
+
+    def allow(self, key: str) -> bool:
+        now = time.time()
+        with self._lock:
+            entry = self._clients.pop(key, None)
+            allowed, state = sliding_window_check(entry[0] if entry else None, now, self.limit, self.window)
+            self._clients[key] = (state, now)
+            self._evict(now)
+        return allowed
+
+
+class SQLiteRateLimiter:
+    """Limiter shared by every worker (process) on the host through one small sqlite table."""
+
+    # allow() may wait (up to the busy timeout) for another worker's write, call it from a thread
+    blocking = True
+
+    def __init__(self, limit: int, window: float, path: str = RATE_LIMIT_DB):
+        self.limit = limit
+        self.window = window
+        self.path = path
+        self._local = threading.local()
+        self._checks = 0
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit ("
+                "key TEXT PRIMARY KEY, window_index INTEGER, current INTEGER, previous INTEGER, last_seen REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS rate_limit_last_seen ON rate_limit (last_seen)")
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            self._local.db = db
+        return db
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM rate_limit").fetchone()[0]
+
+    def allow(self, key: str) -> bool:
+        now = time.time()
+        db = self._connection()
+        # immediate so two workers can't both read the same count and both let a request through
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT window_index, current, previous FROM rate_limit WHERE key = ?", (key,)).fetchone()
+            allowed, state = sliding_window_check(tuple(row) if row else None, now, self.limit, self.window)
+            db.execute(
+                "INSERT INTO rate_limit VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                "window_index = excluded.window_index, current = excluded.current, previous = excluded.previous, last_seen = excluded.last_seen",
+                (key, *state, now),
+            )
+            self._checks += 1
+            if self._checks % SQLITE_EVICT_EVERY == 0:
+                db.execute("DELETE FROM rate_limit WHERE last_seen < ?", (now - 2 * self.window,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+def create_rate_limiter(limit: int, window: float, backend: str = RATE_LIMIT_BACKEND):
+    if backend == "sqlite":
+        try:
+            return SQLiteRateLimiter(limit, window)
+        except sqlite3.Error as e:
+            _logger.warning(f"Could not open the sqlite rate limit db at {RATE_LIMIT_DB}, limiting per worker: {e}")
+    return MemoryRateLimiter(limit, window)
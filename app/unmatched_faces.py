@@ -0,0 +1,169 @@
+from typing import Dict, List, Optional
+import datetime
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from app.face_index import normalize_embeddings
+
+# fixed size ring buffer, the oldest unmatched faces are overwritten once it's full
+UNMATCHED_FACES_CAPACITY = int(os.environ.get("UNMATCHED_FACES_CAPACITY", "5000"))
+# an unmatched face joins the closest cluster when its cosine similarity to the centroid is at least this
+UNMATCHED_CLUSTER_THRESHOLD = float(os.environ.get("UNMATCHED_CLUSTER_THRESHOLD", "0.7"))
+UNMATCHED_MAX_CLUSTERS = int(os.environ.get("UNMATCHED_MAX_CLUSTERS", "1024"))
+
+RECORD_DTYPE = np.dtype([
+    ("id", "S32"),
+    ("timestamp", "f8"),
+    ("closest_match", "i4"),
+    ("closest_similarity", "f4"),
+    ("cluster", "i8"),
+])
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+class UnmatchedFaceStore:
+    """Fixed memory store of recent unmatched faces with online clustering of repeat visitors.
+
+    Records live in a numpy structured ring buffer and embeddings in a parallel float16
+    (capacity, dim) array, so memory is capped at roughly capacity * (dim * 2 + 56) bytes
+    however long the process runs. Each face is assigned to the nearest running-mean
+    centroid (or starts a new cluster), frequent clusters are the shoppers worth enrolling.
+    """
+
+    def __init__(self, capacity: int = UNMATCHED_FACES_CAPACITY, cluster_threshold: float = UNMATCHED_CLUSTER_THRESHOLD, max_clusters: int = UNMATCHED_MAX_CLUSTERS):
+        self.capacity = capacity
+        self.cluster_threshold = cluster_threshold
+        self.max_clusters = max_clusters
+        self._lock = threading.Lock()
+        self._records = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self._embeddings: Optional[np.ndarray] = None
+        self._next = 0
+        self._size = 0
+        # closest_match labels are interned, -1 = no closest match
+        self._labels: List[str] = []
+        self._label_ids: Dict[str, int] = {}
+        # cluster slots: centroid, size and first/last seen, cluster ids are never reused
+        self._centroids: Optional[np.ndarray] = None
+        self._cluster_ids = np.full(max_clusters, -1, dtype=np.int64)
+        self._cluster_counts = np.zeros(max_clusters, dtype=np.int64)
+        self._cluster_first_seen = np.zeros(max_clusters, dtype=np.float64)
+        self._cluster_last_seen = np.zeros(max_clusters, dtype=np.float64)
+        self._next_cluster_id = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _label_id(self, label: Optional[str]) -> int:
+        if label is None:
+            return -1
+        if label not in self._label_ids:
+            self._label_ids[label] = len(self._labels)
+            self._labels.append(label)
+        return self._label_ids[label]
+
+    def _assign_cluster(self, embedding: np.ndarray, now: float) -> int:
+        live = self._cluster_ids >= 0
+        if live.any():
+            similarities = self._centroids @ embedding
+            similarities[~live] = -np.inf
+            slot = int(np.argmax(similarities))
+            if similarities[slot] >= self.cluster_threshold:
+                count = self._cluster_counts[slot]
+                self._centroids[slot] = normalize_embeddings(self._centroids[slot] * count + embedding)[0]
+                self._cluster_counts[slot] = count + 1
+                self._cluster_last_seen[slot] = now
+                return int(self._cluster_ids[slot])
+
+        # new cluster, recycling the least recently seen one when every slot is taken
+        free = np.flatnonzero(~live)
+        slot = int(free[0]) if len(free) else int(np.argmin(self._cluster_last_seen))
+        self._centroids[slot] = embedding
+        self._cluster_ids[slot] = self._next_cluster_id
+        self._cluster_counts[slot] = 1
+        self._cluster_first_seen[slot] = now
+        self._cluster_last_seen[slot] = now
+        self._next_cluster_id += 1
+        return int(self._cluster_ids[slot])
+
+    def add(self, embedding: Optional[np.ndarray], closest_match: Optional[str], closest_similarity: float) -> str:
+        """Record an unmatched face and return its id."""
+        uid = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            cluster = -1
+            if embedding is not None:
+                embedding = normalize_embeddings(embedding)[0]
+                if self._embeddings is None:
+                    self._embeddings = np.zeros((self.capacity, len(embedding)), dtype=np.float16)
+                    self._centroids = np.zeros((self.max_clusters, len(embedding)), dtype=np.float32)
+                self._embeddings[self._next] = embedding
+                cluster = self._assign_cluster(embedding, now)
+            self._records[self._next] = (uid, now, self._label_id(closest_match), closest_similarity, cluster)
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+        return uid
+
+    def _newest_first(self) -> np.ndarray:
+        # slot indexes from newest to oldest
+        return (self._next - 1 - np.arange(self._size)) % self.capacity
+
+    def _to_dict(self, record) -> dict:
+        label_id = int(record["closest_match"])
+        return {
+            "id": record["id"].decode(),
+            "timestamp": _isoformat(float(record["timestamp"])),
+            "closest_match": self._labels[label_id] if label_id >= 0 else None,
+            "closest_similarity": round(float(record["closest_similarity"]), 4),
+            "cluster": int(record["cluster"]) if record["cluster"] >= 0 else None,
+        }
+
+    def page(self, offset: int = 0, limit: int = 50, since: Optional[float] = None, until: Optional[float] = None, cluster: Optional[int] = None) -> dict:
+        """Newest first page of unmatched faces, optionally filtered to a time range / cluster."""
+        with self._lock:
+            records = self._records[self._newest_first()]
+            keep = np.ones(len(records), dtype=bool)
+            if since is not None:
+                keep &= records["timestamp"] >= since
+            if until is not None:
+                keep &= records["timestamp"] < until
+            if cluster is not None:
+                keep &= records["cluster"] == cluster
+            records = records[keep]
+            return {
+                "total": len(records),
+                "offset": offset,
+                "limit": limit,
+                "unmatched_faces": [self._to_dict(record) for record in records[offset:offset + limit]],
+            }
+
+    def clusters(self, min_count: int = 2, limit: int = 50) -> List[dict]:
+        """Largest clusters first, these are repeat visitors worth adding to the gallery."""
+        with self._lock:
+            slots = np.flatnonzero((self._cluster_ids >= 0) & (self._cluster_counts >= min_count))
+            slots = slots[np.argsort(-self._cluster_counts[slots], kind="stable")][:limit]
+            return [{
+                "cluster": int(self._cluster_ids[slot]),
+                "count": int(self._cluster_counts[slot]),
+                "first_seen": _isoformat(float(self._cluster_first_seen[slot])),
+                "last_seen": _isoformat(float(self._cluster_last_seen[slot])),
+            } for slot in slots]
+
+    def cluster_centroid(self, cluster: int) -> Optional[np.ndarray]:
+        """Mean embedding of a cluster, usable to enroll the repeat visitor into the gallery."""
+        with self._lock:
+            slots = np.flatnonzero(self._cluster_ids == cluster)
+            return self._centroids[slots[0]].copy() if len(slots) else None
+
+    def memory_bytes(self) -> int:
+        arrays = [self._records, self._embeddings, self._centroids, self._cluster_ids, self._cluster_counts, self._cluster_first_seen, self._cluster_last_seen]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+
+unmatched_faces = UnmatchedFaceStore()
@@ -0,0 +1,39 @@
+from typing import Any
+import asyncio
+import time
+
+
+class VersionedState:
+    """A value + a version that bumps on every actual change, waiters wake on an asyncio condition.
+
+    Lets display clients block until something changes (long poll / sse) instead of polling.
+    """
+
+    def __init__(self, value: Any = None):
+        self.value = value
+        self.version = 0
+        self.updated_at = time.time()
+        self._condition = asyncio.Condition()
+
+    async def set(self, value: Any) -> bool:
+        """Store value, returns False (and wakes nobody) if it didn't change."""
+        async with self._condition:
+            if value == self.value:
+                return False
+            self.value = value
+            self.version += 1
+            self.updated_at = time.time()
+            self._condition.notify_all()
+        return True
+
+    async def wait_for_change(self, since: int, timeout: float) -> bool:
+        """Wait until the version differs from `since` or timeout, returns whether it changed."""
+        async with self._condition:
+            try:
+                await asyncio.wait_for(self._condition.wait_for(lambda: self.version != since), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.version != since
+
+    def snapshot(self) -> dict:
+        return {"value": self.value, "version": self.version, "updated_at": self.updated_at}
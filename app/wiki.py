@@ -4,7 +4,10 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field, asdict, replace
+from functools import lru_cache
+from typing import Optional
+from contextlib import asynccontextmanager
 import json
 import markdown
 from pathlib import Path
@@ -12,15 +15,21 @@ import logging
 import os
 from datetime import datetime
 import random
-from rapidfuzz import process, fuzz
+
+from app import http_cache
+from app.http_cache import conditional_response, make_etag
+from app.wiki_search import TopicSearchIndex, html_to_text
+from app.full_text_search import load_full_text_index, get_full_text_index
+from app.content_pack import get_content_pack
+from app.metrics import timed, instrument_templates
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 _logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/wiki")
 templates = Jinja2Templates(directory="app/templates")
+instrument_templates(templates)
 
 
 # ------ Wiki Utils -------
@@ -154,18 +163,350 @@ class PersonalSection:
     section_content: str
     section_image_link:str
 
+GENERATED_CONTENT_DIR = Path("app/static/content/generated")
+# per-topic artifacts written by build_wiki.py (one pre-rendered json per topic)
+TOPIC_ARTIFACT_DIR = GENERATED_CONTENT_DIR / "topics"
+TOPIC_ARTIFACT_CACHE_SIZE = int(os.environ.get("WIKI_TOPIC_CACHE_SIZE", "256"))
+# search thumbnails (image + plain text overview) for every topic, also written by build_wiki.py
+TOPIC_THUMBNAILS_FILE = GENERATED_CONTENT_DIR / "topic_thumbnails.json"
+WIKI_IMG_PATH = "/static/img/generated"
+# the token fact mixed into every wiki page
+HITCHCOCK_FACTS_FILE = Path("app/static/content/facts/alfred_hitchcock.json")
+# generated json file -> WikiContent field
+WIKI_CONTENT_FILES = {
+    "section_bodies.json": "sections",
+    "related_to_me.json": "related_to_me",
+    "book_refs.json": "book_refs",
+    "article_refs.json": "article_refs",
+}
+
+@dataclass
+class WikiContent:
+    topics: list[str]
+    sections: dict
+    related_to_me: dict
+    book_refs: dict
+    article_refs: dict
+    artifact_topics: set = field(default_factory=set)
+    # mtimes of the files this content was read from, used for http validators
+    version: str = ""
+
+
+@dataclass
+class TopicPage:
+    """Everything needed to render one wiki topic, with markdown + refs already rendered to html"""
+    topic: str
+    sections: list[SectionData]
+    personal_section: PersonalSection
+    refs: list[str]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TopicPage":
+        return cls(
+            topic = data["topic"],
+            sections = [SectionData(**section) for section in data["sections"]],
+            personal_section = PersonalSection(**data["personal_section"]),
+            refs = data["refs"],
+        )
+
+
+class WikiStore:
+    """
+    Generated wiki content, parsed and key-normalized once (at router startup)
+    so page views are plain dict lookups instead of re-reading ~3.5 MB of JSON.
+
+    If per-topic artifacts have been built (see build_wiki.py) only the topic
+    list is held in memory and topics are read on demand through a bounded LRU,
+    so memory stays flat as the number of topics grows. Topics in the content
+    pack (build_content_pack.py) are parsed straight from the shared mapping
+    instead, no per worker copy is kept.
+    """
+
+    def __init__(self, content_dir: Path = GENERATED_CONTENT_DIR, artifact_dir: Optional[Path] = TOPIC_ARTIFACT_DIR):
+        self.content_dir = content_dir
+        self.artifact_dir = artifact_dir
+        self.content: WikiContent = None
+        # (mtime_ns, size) per topic artifact, stat'ed once and refreshed by reload_topic,
+        # so versions are the same in every worker. stale cache entries just age out
+        self._artifact_stats: dict[str, Optional[tuple]] = {}
+        # version of the facts file every page mixes in
+        self.facts_version = ""
+        # (topic list, hash of it) for the see also seed
+        self._topics_hash: tuple = (None, "")
+        self._read_artifact = lru_cache(maxsize=TOPIC_ARTIFACT_CACHE_SIZE)(self._read_artifact_file)
+
+    @property
+    def loaded(self) -> bool:
+        return self.content is not None
+
+    @property
+    def uses_artifacts(self) -> bool:
+        return bool(self.content.artifact_topics)
+
+    def _read_topics(self) -> list[str]:
+        with open(self.content_dir / "generated_topics.txt", "r") as f:
+            topics = f.read()
+        return [topic for topic in topics.split("\n") if topic != ""]
+
+    def _read_topic_dict(self, filename: str) -> dict:
+        path = self.content_dir / filename
+        if not path.exists():
+            _logger.warning(f"Generated wiki content missing: {path}")
+            return {}
+        with open(path, "r") as f, timed("json_load"):
+            topic_dict = json.loads(f.read())
+        return get_cleaned_key_dict(topic_dict)
+
+    def _source_paths(self, use_artifacts: bool) -> list[Path]:
+        if use_artifacts:
+            # each artifact is versioned on its own (get_topic_version), the artifact dir's mtime would also
+            # move when unrelated files (e.g. precompressed siblings) are written next to the artifacts
+            return [self.content_dir / "generated_topics.txt"]
+        return [self.content_dir / filename for filename in ["generated_topics.txt", *WIKI_CONTENT_FILES.keys()]]
+
+    def _read_version(self, use_artifacts: bool) -> str:
+        versions = []
+        for path in self._source_paths(use_artifacts):
+            if path.exists():
+                versions.append(f"{path.name}:{path.stat().st_mtime_ns}")
+        return "|".join(versions)
+
+    def _read_artifact_topics(self) -> set:
+        if self.artifact_dir is None or not self.artifact_dir.exists():
+            return set()
+        return {artifact.stem for artifact in self.artifact_dir.glob("*.json")}
+
+    def _read_packed_artifact(self, topic: str) -> Optional[dict]:
+        content_pack = get_content_pack()
+        if content_pack is None:
+            return None
+        # the cached stat (refreshed by the content watcher), so a packed hit never touches the disk
+        version = self._artifact_version(topic)
+        if version is None:
+            return None
+        content = content_pack.get(f"wiki/{topic}", version)
+        if content is None:
+            return None
+        with timed("json_load"):
+            return json.loads(content)
+
+    def _stat_artifact(self, topic: str) -> Optional[tuple]:
+        try:
+            stat = (self.artifact_dir / f"{topic}.json").stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _artifact_version(self, topic: str) -> Optional[tuple]:
+        if topic not in self._artifact_stats:
+            self._artifact_stats[topic] = self._stat_artifact(topic)
+        return self._artifact_stats[topic]
+
+    def _read_facts_version(self) -> str:
+        try:
+            stat = HITCHCOCK_FACTS_FILE.stat()
+        except FileNotFoundError:
+            return ""
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def _read_artifact_file(self, topic: str, version: Optional[tuple] = None) -> dict:
+        with open(self.artifact_dir / f"{topic}.json", "r") as f, timed("json_load"):
+            return json.loads(f.read())
+
+    def load(self, use_artifacts: bool = True) -> "WikiStore":
+        # build everything first, then swap in one assignment so requests
+        # running during a reload never see half-loaded content
+        artifact_topics = self._read_artifact_topics() if use_artifacts else set()
+        if artifact_topics:
+            content = WikiContent(
+                topics = self._read_topics(),
+                sections = {},
+                related_to_me = {},
+                book_refs = {},
+                article_refs = {},
+                artifact_topics = artifact_topics,
+                version = self._read_version(use_artifacts = True),
+            )
+        else:
+            content = WikiContent(
+                topics = self._read_topics(),
+                **{content_field: self._read_topic_dict(filename) for filename, content_field in WIKI_CONTENT_FILES.items()},
+                version = self._read_version(use_artifacts = False),
+            )
+        self.content = content
+        self._artifact_stats = {}
+        self.facts_version = self._read_facts_version()
+        self._read_artifact.cache_clear()
+        _logger.info(f"Loaded wiki content for {len(content.topics)} topics (per-topic artifacts: {bool(artifact_topics)})")
+        return self
+
+    def reload(self) -> "WikiStore":
+        """Explicit reload hook, e.g. after regenerating the wiki content."""
+        return self.load()
+
+    def reload_file(self, filename: str):
+        """Re-parse a single generated content file and swap it into the current content."""
+        if not self.loaded:
+            return
+        if filename == "generated_topics.txt":
+            self.content = replace(self.content, topics = self._read_topics(), version = self._read_version(self.uses_artifacts))
+        elif filename in WIKI_CONTENT_FILES and not self.uses_artifacts:
+            content_field = WIKI_CONTENT_FILES[filename]
+            self.content = replace(self.content, **{content_field: self._read_topic_dict(filename)}, version = self._read_version(use_artifacts = False))
+        else:
+            return
+        _logger.info(f"Reloaded wiki content file: {filename}")
+
+    def reload_topic(self, topic: str):
+        """Pick up a new, changed or deleted per-topic artifact."""
+        if not self.loaded or not self.uses_artifacts:
+            return
+        artifact_topics = set(self.content.artifact_topics)
+        if (self.artifact_dir / f"{topic}.json").exists():
+            artifact_topics.add(topic)
+        else:
+            artifact_topics.discard(topic)
+        self._artifact_stats[topic] = self._stat_artifact(topic)
+        self.content = replace(self.content, artifact_topics = artifact_topics)
+
+    def reload_facts(self):
+        self.facts_version = self._read_facts_version()
+
+    def has_topic(self, topic: str) -> bool:
+        if self.uses_artifacts:
+            return topic in self.content.artifact_topics
+        return topic in self.content.sections
+
+    def get_topics(self) -> list[str]:
+        return self.content.topics
+
+    def get_sections(self, topic: str) -> dict:
+        return self.content.sections[topic]
+
+    def get_related_to_me(self, topic: str) -> str:
+        return self.content.related_to_me.get(topic, "")
+
+    def get_book_refs(self, topic: str) -> list[dict]:
+        return self.content.book_refs.get(topic, [])
+
+    def get_article_refs(self, topic: str) -> list[dict]:
+        return self.content.article_refs.get(topic, [])
+
+    def get_topic_version(self, topic: str) -> str:
+        """Version of everything a topic page is rendered from, derived from the files so every worker agrees."""
+        artifact_version = self._artifact_version(topic) if self.uses_artifacts else None
+        return f"{self.content.version}|{artifact_version}|{self.facts_version}"
+
+    def get_picks_seed(self, topic: str) -> str:
+        """
+        Seed for a topic page's see also + fact picks, from what they are drawn
+        from (the topic list and the facts file), so it's the same in every worker
+        and in the prerendered build, and only edits to those reshuffle them.
+        """
+        topics = self.content.topics
+        if self._topics_hash[0] is not topics:
+            self._topics_hash = (topics, make_etag(*topics))
+        return f"{topic}|{self._topics_hash[1]}|{self.facts_version}"
+
+    def get_topic_page(self, topic: str) -> TopicPage:
+        if self.uses_artifacts:
+            topic_dict = self._read_packed_artifact(topic)
+            if topic_dict is None:
+                topic_dict = self._read_artifact(topic, self._artifact_version(topic))
+            return TopicPage.from_dict(topic_dict)
+        with timed("markdown_render"):
+            return build_topic_page(topic)
+
+    def cache_stats(self) -> dict:
+        """Hits/misses of the per-topic artifact LRU (topics read from the content pack bypass it)."""
+        info = self._read_artifact.cache_info()
+        return {"entries": info.currsize, "max_entries": info.maxsize, "hits": info.hits, "misses": info.misses}
+
+
+wiki_store = WikiStore()
+
+def get_wiki_store() -> WikiStore:
+    # scripts (e.g. generate_sitemap) use the store without the router lifespan
+    if not wiki_store.loaded:
+        wiki_store.load()
+    return wiki_store
+
+def get_topic_thumbnail(first_section: SectionData) -> dict:
+    return {
+        "image": first_section.section_image_link,
+        "overview": html_to_text(first_section.section_content)[0:100] + "..."
+    }
+
+def build_topic_thumbnails(store: WikiStore) -> dict:
+    # only needs the first section of every topic, so skip the full page render
+    thumbnails = {}
+    for topic in store.get_topics():
+        topic_path = clean_topic_name(topic)
+        if not store.has_topic(topic_path):
+            continue
+        if store.uses_artifacts:
+            first_section = store.get_topic_page(topic_path).sections[0]
+        else:
+            section_title, section_content = next(iter(store.get_sections(topic_path).items()))
+            first_section = SectionData(
+                section_title = section_title,
+                section_content = markdown.markdown(section_content, extensions=['fenced_code', 'codehilite']),
+                section_image_link = f"{WIKI_IMG_PATH}/{topic_path}/{clean_topic_name(section_title)}.webp"
+            )
+        thumbnails[topic_path] = get_topic_thumbnail(first_section)
+    return thumbnails
+
+def load_topic_thumbnails(store: WikiStore) -> dict:
+    if store.uses_artifacts and TOPIC_THUMBNAILS_FILE.exists():
+        with open(TOPIC_THUMBNAILS_FILE, "r") as f:
+            return json.loads(f.read())
+    return build_topic_thumbnails(store)
+
+_topic_search_index: TopicSearchIndex = None
+# the topic list the index was built from
+_topic_search_source: list = None
+
+def get_topic_search_index() -> TopicSearchIndex:
+    global _topic_search_index, _topic_search_source
+    store = get_wiki_store()
+    # rebuilt whenever the store swaps in a new topic list
+    if _topic_search_index is None or _topic_search_source is not store.get_topics():
+        thumbnails = load_topic_thumbnails(store)
+        topics = []
+        records = []
+        seen = set()
+        for topic in store.get_topics():
+            thumbnail = thumbnails.get(clean_topic_name(topic))
+            # the generated topic list has some repeats
+            if thumbnail is None or clean_topic_name(topic) in seen:
+                continue
+            seen.add(clean_topic_name(topic))
+            topics.append(topic)
+            records.append({"src": clean_topic_name(topic), "title": topic, **thumbnail})
+        _topic_search_index = TopicSearchIndex(topics, records)
+        _topic_search_source = store.get_topics()
+        _logger.info(f"Built wiki search index for {len(_topic_search_index)} topics")
+    return _topic_search_index
+
+def invalidate_topic_search_index():
+    global _topic_search_index
+    _topic_search_index = None
+
+@asynccontextmanager
+async def load_wiki_content(app):
+    get_wiki_store()
+    get_topic_search_index()
+    load_full_text_index()
+    yield
+
 def get_topics() -> list:
-    with open("app/static/content/generated/generated_topics.txt", "r") as f:
-        topics = f.read()
-    topics = topics.split("\n")
-    return topics
+    return get_wiki_store().get_topics()
 
 def get_sections_for_topic(topic:str, base_path: str = "") -> list[SectionData]:
-    with open("app/static/content/generated/section_bodies.json", "r") as f:
-        topic_sections = json.loads(f.read())
-
-    topic_sections = get_cleaned_key_dict(topic_sections)
-    sections = topic_sections[topic]
+    sections = get_wiki_store().get_sections(topic)
     topic_path = clean_topic_name(topic)
     data = []
     for section_title, section_content in sections.items():
@@ -179,41 +520,23 @@ def get_sections_for_topic(topic:str, base_path: str = "") -> list[SectionData]:
     return data
 
 def get_personal_section_for_topic(topic:str) -> PersonalSection:
-    # may add in later...
-    with open("app/static/content/generated/related_to_me.json", "r") as f:
-        topic_sections = json.loads(f.read())
-
-    topic_sections = get_cleaned_key_dict(topic_sections)
-    
     personal_section = PersonalSection(
         section_title = "Related To Preston Blackburn",
-        section_content = markdown.markdown(topic_sections[topic], extensions=['fenced_code', 'codehilite']),
+        section_content = markdown.markdown(get_wiki_store().get_related_to_me(topic), extensions=['fenced_code', 'codehilite']),
         section_image_link = "/static/img/wiki/icons/placeholder_image.jpg"
     )
     return personal_section
 
 def get_book_references_for_topic(topic:str) -> list[BookReference]:
-    with open("app/static/content/generated/book_refs.json", "r") as f:
-        refs = json.loads(f.read())
-    
-    refs = get_cleaned_key_dict(refs)
-
-    filtered_refs = refs[topic]
     book_refs = []
-    for ref in filtered_refs:
+    for ref in get_wiki_store().get_book_refs(topic):
         book_ref = BookReference(**ref)
         book_refs.append(book_ref)
     return book_refs
 
 def get_article_references_for_topic(topic:str) -> list[ArticleReference]:
-    with open("app/static/content/generated/article_refs.json", "r") as f:
-        refs = json.loads(f.read())
-    
-    refs = get_cleaned_key_dict(refs)
-
-    filtered_refs = refs[topic]
     article_refs = []
-    for ref in filtered_refs:
+    for ref in get_wiki_store().get_article_refs(topic):
         article_ref = ArticleReference(**ref)
         article_refs.append(article_ref)
 
@@ -232,17 +555,25 @@ def get_articles_for_topic(topic:str) -> list[str]:
             refs.append(article_refs[i].to_string())   
     return refs
 
+def build_topic_page(topic:str, base_path: str = WIKI_IMG_PATH) -> TopicPage:
+    return TopicPage(
+        topic = topic,
+        sections = get_sections_for_topic(topic, base_path = base_path),
+        personal_section = get_personal_section_for_topic(topic),
+        refs = get_articles_for_topic(topic),
+    )
+
 TOKEN = "M-A-C-G-U-F-F-I-N"
 
-def get_random_hitchcock_fact():
-    with open("app/static/content/facts/alfred_hitchcock.json", "r") as f:
+def get_random_hitchcock_fact(rng: random.Random = random):
+    with open(HITCHCOCK_FACTS_FILE, "r") as f:
         facts = json.loads(f.read())
     facts_list = facts["facts"]
-    idx = random.randint(0, len(facts_list)-1)
+    idx = rng.randint(0, len(facts_list)-1)
     return facts_list[idx]
 
-def get_token_content():
-    fact = get_random_hitchcock_fact()
+def get_token_content(rng: random.Random = random):
+    fact = get_random_hitchcock_fact(rng)
     token_content = f"&lt;{TOKEN}&gt; {fact}"
     token_content_js = f"<{TOKEN}> {fact}"
     html_content = f"""<p class="token-text">{token_content}</p>"""
@@ -253,6 +584,8 @@ def get_token_content():
 
 # ------------ Endpoints ------------
 
+router = APIRouter(prefix="/wiki", lifespan=load_wiki_content)
+
 def get_home_page(
         request: Request,
         templates: Jinja2Templates
@@ -261,26 +594,23 @@ def get_home_page(
     response = templates.TemplateResponse("pages/wiki_search.html", context)
     return response
 
-def get_wiki_page(
-    request: Request, 
-    templates: Jinja2Templates, 
-    topic: str
-) -> HTMLResponse:
-    
-    base_img_path = "/static/img/generated"
+def get_wiki_page_context(topic: str) -> dict:
+    base_img_path = WIKI_IMG_PATH
     # topic = "Kubernetes for ML Infrastructure"
-    sections = get_sections_for_topic(topic, base_path = base_img_path)
-    personal_section = get_personal_section_for_topic(topic)
+    topic_page = get_wiki_store().get_topic_page(topic)
+    sections = topic_page.sections
+    personal_section = topic_page.personal_section
     see_also = get_topics()
-    see_also_limited = [see_also[random.randint(1, len(see_also))] for _ in range(0, random.randint(3, 8))]
+    # seeded (see get_picks_seed) so a page is byte-identical for as long as its etag is
+    rng = random.Random(get_wiki_store().get_picks_seed(topic))
+    see_also_limited = [see_also[rng.randint(1, len(see_also) - 1)] for _ in range(0, rng.randint(3, 8))]
     see_also_with_links = [(topic, f"/wiki/{clean_topic_name(topic)}") for topic in see_also_limited]
-    refs = get_articles_for_topic(topic)
+    refs = topic_page.refs
     sections = [section.get_section_image_path(topic, base_img_path) for section in sections]
-    token_html_content, token_js_content = get_token_content()
+    token_html_content, token_js_content = get_token_content(rng)
     sections[-1].section_content = f"""{sections[-1].section_content} {token_html_content}"""
 
     context = {
-        "request": request, 
         "landing_page": True,
         # we have a lot of data to provide...
         "title": topic.replace("_", " "),
@@ -293,6 +623,14 @@ def get_wiki_page(
         "refs": refs,
         "metadata": token_js_content
     }
+    return context
+
+def get_wiki_page(
+    request: Request, 
+    templates: Jinja2Templates, 
+    topic: str
+) -> HTMLResponse:
+    context = {"request": request, **get_wiki_page_context(topic)}
     # later - contextually show landing page stuff
     response = templates.TemplateResponse("pages/wiki.html", context)
 
@@ -303,26 +641,21 @@ def get_searched_wiki_pages(
     templates: Jinja2Templates, 
     search_text: str
 ):
-    base_img_path = "/static/img/generated"
-    all_topics = get_topics()
     _logger.info(f"Searching For: {search_text}")
-    similar_topics = process.extract(
-        search_text, 
-        all_topics, 
-        scorer=fuzz.WRatio, 
-        limit=10
-    )
-    _logger.info(f"Similar Topics: {similar_topics}")
-    thumbnails = []
-    for topic, score, rank in similar_topics:
-        sections = get_sections_for_topic(clean_topic_name(topic), base_path = base_img_path)
-        thumbnail = {
-            "src": f"{clean_topic_name(topic)}",
-            "title": topic,
-            "image": sections[0].section_image_link,
-            "overview": sections[0].section_content[0:100] + "..."
-        }
-        thumbnails.append(thumbnail)
+    topic_search_index = get_topic_search_index()
+    thumbnails = topic_search_index.search(search_text, limit=10)
+
+    # mix in topics whose content (not just title) matches, when the full text index is built
+    full_text_index = get_full_text_index()
+    if full_text_index is not None:
+        content_hits = full_text_index.search(search_text, limit=5, kind="wiki")
+        content_thumbnails = [topic_search_index.get_record(hit.url.removeprefix("/wiki/")) for hit in content_hits]
+        title_srcs = {thumbnail["src"] for thumbnail in thumbnails[:5]}
+        content_thumbnails = [thumbnail for thumbnail in content_thumbnails if thumbnail is not None and thumbnail["src"] not in title_srcs]
+        merged = thumbnails[:5] + content_thumbnails
+        merged_srcs = {thumbnail["src"] for thumbnail in merged}
+        thumbnails = (merged + [thumbnail for thumbnail in thumbnails[5:] if thumbnail["src"] not in merged_srcs])[:10]
+    _logger.info(f"Similar Topics: {[thumbnail['title'] for thumbnail in thumbnails]}")
 
     context = {
         "request": request, 
@@ -343,7 +676,11 @@ async def get_page(
     request: Request,
     topic: str
 ) -> HTMLResponse:
-    response = get_wiki_page(request, templates, topic)
+    store = get_wiki_store()
+    if not store.has_topic(topic):
+        raise HTTPException(status_code=404, detail="Topic not found")
+    etag = make_etag("wiki", topic, store.get_topic_version(topic), http_cache.TEMPLATES_VERSION)
+    response = conditional_response(request, etag, lambda: get_wiki_page(request, templates, topic))
     return response
 
 @router.post("/search")
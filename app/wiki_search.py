@@ -0,0 +1,95 @@
+from html import unescape
+from typing import Optional
+import re
+
+import numpy as np
+from rapidfuzz import process, fuzz
+from rapidfuzz.utils import default_process
+
+# WRatio only runs over this many trigram-filtered candidates
+MAX_FUZZY_CANDIDATES = 64
+
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def html_to_text(html: str) -> str:
+    text = unescape(_TAG_PATTERN.sub(" ", html))
+    return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def get_trigrams(text: str) -> set[str]:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TopicSearchIndex:
+    """
+    Fuzzy topic title search. Topic titles are normalized once and indexed by
+    trigram (and by 1-2 character word prefix for very short queries), so each
+    query only runs WRatio over a small set of candidates instead of every topic.
+    """
+
+    def __init__(self, topics: list[str], records: list[dict], max_candidates: int = MAX_FUZZY_CANDIDATES):
+        # records[i] is the precomputed thumbnail for topics[i]
+        self.topics = topics
+        self.records = records
+        self.max_candidates = max_candidates
+        self.normalized = [default_process(topic) for topic in topics]
+        self._records_by_src = {record["src"]: record for record in records}
+
+        trigrams: dict[str, list[int]] = {}
+        prefixes: dict[str, list[int]] = {}
+        for topic_id, text in enumerate(self.normalized):
+            for trigram in get_trigrams(text):
+                trigrams.setdefault(trigram, []).append(topic_id)
+            for word in set(text.split()):
+                for prefix in {word[:1], word[:2]}:
+                    prefixes.setdefault(prefix, []).append(topic_id)
+        self._trigrams = {trigram: np.array(ids, dtype=np.int32) for trigram, ids in trigrams.items()}
+        self._prefixes = {prefix: np.array(ids, dtype=np.int32) for prefix, ids in prefixes.items()}
+
+    def __len__(self) -> int:
+        return len(self.topics)
+
+    def get_record(self, src: str) -> Optional[dict]:
+        return self._records_by_src.get(src)
+
+    def _get_candidates(self, query: str) -> np.ndarray:
+        if len(query) < 3:
+            return self._prefixes.get(query.split()[0][:2], np.empty(0, dtype=np.int32))
+
+        postings = [self._trigrams[trigram] for trigram in get_trigrams(query) if trigram in self._trigrams]
+        if not postings:
+            return np.empty(0, dtype=np.int32)
+        # rank topics by how many query trigrams they share and keep the best few.
+        # the cut off comes from a histogram of the counts, which is cheaper than
+        # partitioning every topic
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.topics))
+        counts_histogram = np.bincount(counts)
+        counts_histogram[0] = 0
+        topics_at_or_above = np.cumsum(counts_histogram[::-1])[::-1]
+        threshold = max(1, int(np.flatnonzero(topics_at_or_above >= self.max_candidates)[-1])) \
+            if topics_at_or_above[1] >= self.max_candidates else 1
+        candidates = np.flatnonzero(counts >= threshold)
+        if len(candidates) <= self.max_candidates:
+            return candidates
+        # too many ties at the threshold, keep everything above it and fill up with ties
+        candidate_counts = counts[candidates]
+        above = candidates[candidate_counts > threshold]
+        ties = candidates[candidate_counts == threshold][:self.max_candidates - len(above)]
+        return np.concatenate([above, ties])
+
+    def search(self, search_text: str, limit: int = 10) -> list[dict]:
+        query = default_process(search_text)
+        if not query:
+            return []
+        candidate_ids = self._get_candidates(query)
+        matches = process.extract(
+            query,
+            [self.normalized[topic_id] for topic_id in candidate_ids],
+            scorer=fuzz.WRatio,
+            processor=None,
+            limit=limit
+        )
+        return [self.records[candidate_ids[idx]] for _, _, idx in matches]
@@ -0,0 +1,79 @@
+"""Recall + latency of the IVF face index against exact search.
+
+python -m benchmarks.face_ann_recall --size 50000 --nprobe 1 4 8 16 32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.face_index import FaceGallery, IVFFaceIndex
+
+EMBEDDING_DIM = 512  # Facenet512
+
+
+def make_gallery(size: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    # face embeddings are clumpy (same person / lighting), so sample around cluster centres
+    # rather than uniformly on the sphere, which is the worst case for any ivf index
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    assignments = rng.integers(0, clusters, size)
+    return centres[assignments] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+
+
+def make_queries(gallery: np.ndarray, count: int, seed: int) -> np.ndarray:
+    # noisy re-captures of enrolled faces
+    rng = np.random.default_rng(seed + 1)
+    picks = gallery[rng.integers(0, len(gallery), count)]
+    return picks + 0.3 * rng.standard_normal(picks.shape).astype(np.float32)
+
+
+def time_queries(index, queries: np.ndarray, k: int, **kwargs) -> tuple[list, np.ndarray]:
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, k=k, **kwargs))
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000
+
+
+def recall_at_k(exact: list, approximate: list) -> float:
+    hits = sum(len({m.label for m in e} & {m.label for m in a}) for e, a in zip(exact, approximate))
+    return hits / sum(len(e) for e in exact)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embeddings = make_gallery(args.size, args.dim, args.clusters, args.seed)
+    labels = [f"face-{i}" for i in range(args.size)]
+    queries = make_queries(embeddings, args.queries, args.seed)
+
+    exact_index = FaceGallery(labels, embeddings)
+    start = time.perf_counter()
+    ivf_index = IVFFaceIndex(labels, embeddings, nlist=args.nlist)
+    build_seconds = time.perf_counter() - start
+    print(f"gallery={args.size} dim={args.dim} nlist={ivf_index.nlist} build={build_seconds:.2f}s k={args.k}")
+
+    exact, exact_ms = time_queries(exact_index, queries, args.k)
+    print(f"{'exact':>10}  recall@{args.k}=1.000  p50={np.percentile(exact_ms, 50):.3f}ms  p99={np.percentile(exact_ms, 99):.3f}ms")
+    for nprobe in args.nprobe:
+        approximate, ivf_ms = time_queries(ivf_index, queries, args.k, nprobe=nprobe)
+        top1 = np.mean([a[0].label == e[0].label for e, a in zip(exact, approximate)])
+        print(
+            f"{'nprobe=' + str(nprobe):>10}  recall@{args.k}={recall_at_k(exact, approximate):.3f}  top1={top1:.3f}"
+            f"  p50={np.percentile(ivf_ms, 50):.3f}ms  p99={np.percentile(ivf_ms, 99):.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Throughput vs latency of face embedding micro-batching.
+
+Runs closed loop clients (each sends its next frame as soon as the last one
+returns) against MicroBatcher for every batch size / delay combination.
+
+By default the model is simulated as a fixed per call overhead + a per image
+cost, which is the shape of a cpu Facenet512 forward pass. Pass --image to
+time the real DeepFace model on an image instead.
+
+python -m benchmarks.face_batching --clients 16 --batch-sizes 1 4 8 16 --delays-ms 2 10 25
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import numpy as np
+
+from app.face_inference import InferencePool, MicroBatcher
+
+
+def simulated_model(call_overhead_ms: float, per_image_ms: float):
+    def represent(items: list) -> list:
+        # sleep releases the gil like tensorflow does, so worker threads overlap
+        time.sleep((call_overhead_ms + per_image_ms * len(items)) / 1000)
+        return [[{"embedding": [0.0] * 512}] for _ in items]
+    return represent
+
+
+def deepface_model(image_path: str):
+    from app.face_images import decode_image
+    from app.facial_recognition import represent_images
+    with open(image_path, "rb") as f:
+        image = decode_image(f.read())
+    return lambda items: represent_images([image] * len(items))
+
+
+async def run_clients(batcher: MicroBatcher, clients: int, seconds: float) -> np.ndarray:
+    latencies = []
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await batcher.submit(b"frame")
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--delays-ms", type=float, nargs="+", default=[2, 10, 25])
+    parser.add_argument("--call-overhead-ms", type=float, default=40.0)
+    parser.add_argument("--per-image-ms", type=float, default=8.0)
+    parser.add_argument("--image", help="time the real model on this image instead of the simulation")
+    args = parser.parse_args()
+
+    if args.image:
+        batch_fn = deepface_model(args.image)
+    else:
+        batch_fn = simulated_model(args.call_overhead_ms, args.per_image_ms)
+
+    print(f"clients={args.clients} workers={args.workers} seconds={args.seconds}")
+    print(f"{'batch':>6} {'delay_ms':>9} {'req/s':>8} {'p50_ms':>8} {'p99_ms':>8} {'mean_batch':>11}")
+    for max_size, delay_ms in itertools.product(args.batch_sizes, args.delays_ms):
+        if max_size == 1 and delay_ms != args.delays_ms[0]:
+            continue  # delay is irrelevant without batching
+        # the queue bound is sized so nothing gets rejected, this measures the batching trade off only
+        pool = InferencePool(workers=args.workers, max_queue=args.clients)
+        batcher = MicroBatcher(batch_fn, pool, max_size=max_size, max_delay_ms=delay_ms)
+        latencies = asyncio.run(run_clients(batcher, args.clients, args.seconds))
+        pool.shutdown()
+        p50, p99 = np.percentile(latencies, [50, 99])
+        stats = batcher.stats()
+        print(
+            f"{max_size:>6} {delay_ms if max_size > 1 else 0:>9.1f} {len(latencies) / args.seconds:>8.1f}"
+            f" {p50:>8.1f} {p99:>8.1f} {stats['mean_batch_size']:>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Per worker memory of the site under uvicorn --workers.
+
+Starts the app with N workers, requests every wiki topic, blog post and page a
+few times (the kernel spreads connections over the workers), then reads each
+worker's /proc/<pid>/smaps_rollup:
+
+- uss: private (unique) memory, what every extra worker actually costs
+- pss: shared pages split evenly between the processes mapping them
+- rss: everything mapped, shared pages counted in full for every worker
+
+Runs once with the content pack (`python -m app.build_content_pack`) and once
+without it. The rendered page cache is turned off by default so it doesn't
+hide the content stores, pass --page-cache to keep it. Linux only.
+
+python -m benchmarks.worker_memory --workers 4 --rounds 2
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def memory_kb(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+        "pss": fields["Pss"],
+        "rss": fields["Rss"],
+    }
+
+
+def worker_pids(pid: int) -> list[int]:
+    children = []
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        children += [int(child) for child in (task / "children").read_text().split()]
+    # uvicorn spawns its workers, skip the multiprocessing resource tracker
+    return [child for child in children if b"spawn_main" in Path(f"/proc/{child}/cmdline").read_bytes()]
+
+
+def get(url: str) -> None:
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            response.read()
+    except urllib.error.HTTPError:
+        pass
+
+
+def site_urls(base_url: str) -> list[str]:
+    from app.host import custom_md_pages
+    from app.wiki import get_wiki_store, clean_topic_name
+
+    with urllib.request.urlopen(f"{base_url}/api/v1/blogs/metadata", timeout=30) as response:
+        blogs = json.loads(response.read())["blogs"]
+    urls = [f"{base_url}/", f"{base_url}/blogs"]
+    urls += [f"{base_url}/{page}" for page in custom_md_pages]
+    urls += [f"{base_url}/blog/{urllib.parse.quote(blog['slug'])}" for blog in blogs]
+    store = get_wiki_store()
+    urls += [f"{base_url}/wiki/{urllib.parse.quote(clean_topic_name(topic))}" for topic in store.get_topics() if store.has_topic(clean_topic_name(topic))]
+    return urls
+
+
+def wait_until_up(base_url: str, server: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            get(f"{base_url}/healthz")
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"uvicorn did not come up on {base_url}")
+
+
+def measure(workers: int, rounds: int, use_pack: bool, page_cache: bool) -> list[dict]:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "CONTENT_PACK": "true" if use_pack else "false",
+        "CONTENT_WATCH": "false",
+        "FACE_MODE": "disabled",
+    }
+    if not page_cache:
+        env["PAGE_CACHE_MAX_BYTES"] = "0"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.host:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(base_url, server)
+        # wait for every worker, not just the first one to accept
+        while len(worker_pids(server.pid)) < workers:
+            time.sleep(0.2)
+        urls = site_urls(base_url)
+        for _ in range(rounds):
+            for url in urls:
+                get(url)
+        return [{"pid": pid, **memory_kb(pid)} for pid in worker_pids(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=2, help="times every page is requested")
+    parser.add_argument("--page-cache", action="store_true", help="keep the rendered page cache on")
+    args = parser.parse_args()
+
+    from app.content_pack import CONTENT_PACK_DIR
+    if not (CONTENT_PACK_DIR / "keys.npy").exists():
+        print(f"No content pack in {CONTENT_PACK_DIR}, run `python -m app.build_content_pack` first")
+        return
+
+    print(f"workers={args.workers} rounds={args.rounds} page_cache={args.page_cache}")
+    print(f"{'pack':>5} {'pid':>8} {'uss_mb':>8} {'pss_mb':>8} {'rss_mb':>8}")
+    for use_pack in (False, True):
+        results = measure(args.workers, args.rounds, use_pack, args.page_cache)
+        for result in results:
+            print(f"{str(use_pack):>5} {result['pid']:>8} {result['uss'] / 1024:>8.1f} {result['pss'] / 1024:>8.1f} {result['rss'] / 1024:>8.1f}")
+        total_uss = sum(result["uss"] for result in results) / 1024
+        total_pss = sum(result["pss"] for result in results) / 1024
+        print(f"{str(use_pack):>5} {'total':>8} {total_uss:>8.1f} {total_pss:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()